@@ -0,0 +1,205 @@
+"""Timing suite for snsphd.hist.
+
+Runs offline on synthetic jitter histograms and writes a JSON file with the git
+commit, library versions and the best-of-n time for every case, so runs on two
+commits can be compared:
+
+    python benchmarks/bench_hist.py --output before.json
+    (checkout another commit)
+    python benchmarks/bench_hist.py --output after.json --compare before.json
+
+It also times `import snsphd` in a fresh interpreter and fails if that imports
+scipy, which hist only needs once a fit runs.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from importlib import metadata
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from snsphd import hist  # noqa: E402
+
+SIZES = (1_000, 10_000, 100_000)
+BATCH_SIZES = (4, 16)
+
+
+def make_hist(n_bins, rng, counts_per_bin=1e4):
+    # peak width and total counts scale with the bin count, so every size sees the
+    # same shape at the same relative noise
+    bins = np.arange(n_bins, dtype=float)
+    sigma = n_bins / 200
+    shape = hist.emg(bins, 1, n_bins / 2, sigma, 2 * sigma)
+    lam = counts_per_bin * n_bins * shape + 0.1
+    return bins, rng.poisson(lam).astype(float)
+
+
+def best_time(fn, setup=None, repeat=3):
+    """Best wall time of `fn(setup())` over `repeat` runs; setup is not timed."""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup is not None else None
+        start = time.perf_counter()
+        fn(arg)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def cases(n_bins, batch_sizes, rng):
+    bins, counts = make_hist(n_bins, rng)
+    tool = lambda: hist.SplineTool(bins, counts)  # noqa: E731
+    yield "SplineTool", lambda _: tool(), None
+    yield "SplineTool.spline_max", lambda t: t.spline_max(), tool
+    yield "SplineTool.full_width_at_level", lambda t: t.full_width_at_level(0.5), tool
+    levels = [0.5, 0.1, 0.01]
+    yield "SplineTool.widths_at_levels", lambda t: t.widths_at_levels(levels), tool
+    # the per-level refits that widths_at_levels replaces
+    yield "SplineTool.full_width_at_level[loop]", lambda t: [
+        t.full_width_at_level(level) for level in levels
+    ], tool
+    yield "SplineTool.gaussian_fit", lambda t: t.gaussian_fit(), tool
+    yield "SplineTool.gaussian_fit(fast)", lambda t: t.gaussian_fit(fast=True), tool
+    yield "GaussianTool.binned_fit", lambda _: hist.GaussianTool.binned_fit(
+        bins, counts
+    ), None
+
+    for n_batch in batch_sizes:
+        stack = np.stack([make_hist(n_bins, rng)[1] for _ in range(n_batch)])
+        batch = lambda: hist.BatchSplineTool(bins, stack)  # noqa: E731
+        suffix = f"[batch={n_batch}]"
+        yield "BatchSplineTool" + suffix, lambda _: batch(), None
+        yield "BatchSplineTool.spline_max" + suffix, lambda t: t.spline_max(), batch
+        yield "BatchSplineTool.full_width_at_level" + suffix, (
+            lambda t: t.full_width_at_level(0.5)
+        ), batch
+        yield "GaussianTool.binned_fit" + suffix, lambda _: (
+            hist.GaussianTool.binned_fit(bins, stack)
+        ), None
+
+
+def import_time(module="snsphd", repeat=5):
+    """Best `python -X importtime` total for `module`, in a fresh interpreter.
+
+    Also returns the top-level packages that the import pulled in.
+    """
+    env = dict(os.environ)
+    src = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    times = []
+    for _ in range(repeat):
+        log = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            env=env,
+        ).stderr
+        imported = set()
+        for line in log.splitlines():
+            fields = line.split("|")
+            if len(fields) != 3 or not fields[1].strip().isdigit():
+                continue
+            name = fields[2].strip()
+            imported.add(name.split(".")[0])
+            if name == module:
+                times.append(int(fields[1]) * 1e-6)
+    return min(times), imported
+
+
+def environment():
+    def version(package):
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return None
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except OSError:
+        commit = ""
+    return {
+        "commit": commit or None,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "scipy": version("scipy"),
+        "snsphd": version("snsphd"),
+    }
+
+
+def run(sizes, batch_sizes, repeat, seed=0):
+    rng = np.random.default_rng(seed)
+    results = []
+    for n_bins in sizes:
+        for name, fn, setup in cases(n_bins, batch_sizes, rng):
+            seconds = best_time(fn, setup, repeat)
+            results.append({"name": name, "n_bins": n_bins, "seconds": seconds})
+            print(f"{name:<48} {n_bins:>8} {seconds * 1e3:>12.3f} ms")
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the time ratio of every case present in both runs.
+
+    Returns the number of cases that got slower by more than `threshold`.
+    """
+    old = {(r["name"], r["n_bins"]): r["seconds"] for r in baseline["results"]}
+    slower = 0
+    print(f"\ncompared to {baseline['environment']['commit']}")
+    for r in results:
+        key = (r["name"], r["n_bins"])
+        if key not in old:
+            continue
+        ratio = r["seconds"] / old[key]
+        flag = ""
+        if ratio > threshold:
+            flag = "  SLOWER"
+            slower += 1
+        print(f"{r['name']:<48} {r['n_bins']:>8} {ratio:>10.2f}x{flag}")
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", default="bench_hist.json")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=BATCH_SIZES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--compare", metavar="BASELINE_JSON")
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.batch_sizes, args.repeat)
+    seconds, imported = import_time(repeat=max(args.repeat, 3))
+    results.append({"name": "import snsphd", "n_bins": 0, "seconds": seconds})
+    print(f"{'import snsphd':<48} {'':>8} {seconds * 1e3:>12.3f} ms")
+    report = {"environment": environment(), "results": results}
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.output}")
+
+    failed = 0
+    # scipy is an optional extra that hist imports on first use only
+    if "scipy" in imported:
+        print("import snsphd imported scipy")
+        failed += 1
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        failed += compare(results, baseline, args.threshold)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
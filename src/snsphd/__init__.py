@@ -16,7 +16,7 @@ try:  # viz depends on bokeh and ipython (extra: "viz")
 except Exception:  # pragma: no cover - optional dependency not installed
     viz = None  # noqa: F401
 
-try:  # hist depends on scipy (extra: "scipy")
+try:  # hist fits need scipy (extra: "scipy"), imported on first use
     from . import hist  # type: ignore
 except Exception:  # pragma: no cover - optional dependency not installed
     hist = None  # noqa: F401
@@ -1,214 +1,2047 @@
-import numpy as np
-from scipy import special
-from scipy.interpolate import UnivariateSpline
-from scipy.stats import rv_continuous
-from collections import namedtuple
-
-from scipy.optimize import curve_fit
-import math
-
-
-# in the SNSPD ccommunity, we are often interested in gaussian-like response functions,
-# and their width metrics like FWHM.
-
-# these tools help with fitting of these response functions, and finding width metrics.
-
-
-class SplineTool:
-    def __init__(self, _bins, hist, smoothing=0):
-        if len(_bins) > len(hist):
-            _bins = _bins[:-1]
-        assert len(hist) == len(_bins)
-        self.hist = np.array(hist)
-        self.bins = np.array(_bins)
-        self.y_scale = np.max(hist)
-        self.norm_hist = hist / self.y_scale
-        self.x_scale = self.bins[-1] - self.bins[0]
-        self.norm_bins = self.bins / self.x_scale
-        self.smoothing = smoothing
-        self.spline = UnivariateSpline(self.norm_bins, self.norm_hist, s=self.smoothing)
-
-    def plot_spline(self, plot_bins, smoothing):
-        self.smoothing = smoothing
-        self.spline.set_smoothing_factor(self.smoothing)
-        norm_plot_bins = plot_bins / self.x_scale
-        norm_plot_points = self.spline(norm_plot_bins)
-        return plot_bins, norm_plot_points * self.y_scale
-
-    def full_width_at_level(self, level, smoothing=None):
-        assert level < 1
-        if smoothing is not None:
-            self.smoothing = smoothing
-
-        # norm_hist goes from 0 to 1, but the max point (1) may not be a good estimate
-        # for the max used for FWHM. Use the max of the spline instead.
-        shifted_level = self.spline_max().y * level
-
-        spline = UnivariateSpline(
-            self.norm_bins, self.norm_hist - shifted_level, s=self.smoothing
-        )
-        roots = spline.roots()
-        # print("roots before: ", roots)
-        roots = roots * self.x_scale
-        # print("xscale: ", self.x_scale)
-
-        if len(roots) < 2:
-            raise ValueError(f"There more or less than 2 roots: {roots}")
-            # print("There more or less than 2 roots")
-            # print("The roots are: ", roots)
-            return 1
-        if len(roots) > 2:
-            print(f"There are more than 2 roots. They are: {roots}")
-            root_1 = roots[np.argmax(np.diff(roots))]
-            root_2 = roots[np.argmax(np.diff(roots)) + 1]
-        if len(roots) == 2:
-            root_1 = roots[0]
-            root_2 = roots[1]
-
-        height = self.y_scale * shifted_level
-        RootData = namedtuple("RootData", "width left right height level")
-        return RootData(
-            width=root_2 - root_1, left=root_1, right=root_2, height=height, level=level
-        )
-
-    @staticmethod
-    def quadratic_spline_roots(spl):
-        # from: https://stackoverflow.com/questions/50371298/find-maximum-minimum-of-a-1d-interpolated-function
-        roots = []
-        knots = spl.get_knots()
-        for a, b in zip(knots[:-1], knots[1:]):
-            u, v, w = spl(a), spl((a + b) / 2), spl(b)
-            t = np.roots([u + w - 2 * v, w - u, 2 * v])
-            t = t[np.isreal(t) & (np.abs(t) <= 1)]
-            roots.extend(t * (b - a) / 2 + (b + a) / 2)
-        return np.array(roots)
-
-    def spline_max(self):
-        cr_pts = self.quadratic_spline_roots(self.spline.derivative())
-        cr_pts = np.append(
-            cr_pts, (self.norm_bins[0], self.norm_bins[-1])
-        )  # also check the endpoints of the interval
-        cr_vals = self.spline(cr_pts)
-        min_index = np.argmin(cr_vals)
-        max_index = np.argmax(cr_vals)
-        MaxData = namedtuple("MaxData", "x y")
-        return MaxData(x=cr_pts[max_index] * self.x_scale, y=cr_vals[max_index])
-
-    def plot_width_at_level_arrows(
-        self,
-        plot,
-        level,
-        width_label=True,
-        width_label_function: callable = None,
-        label_args: dict = {"fontsize": 12, "color": "black", "alpha": 1},
-        arrow_args: dict = {"color": "black", "lw": 1.5, "alpha": 1, "ls": "-"},
-    ):
-        root_data = self.full_width_at_level(level)
-        plot.annotate(
-            text="",
-            xy=(root_data.left, root_data.height),
-            xytext=(root_data.right, root_data.height),
-            arrowprops=dict(
-                shrinkA=0,
-                shrinkB=0,
-                patchA=None,
-                patchB=None,
-                arrowstyle="<->",
-                mutation_scale=16, # increase arrow size
-                **arrow_args,
-            ),
-            label=f"full width at {level} max",
-            bbox=dict(pad=0),
-        )
-        font_size = label_args.get("fontsize", 12)
-        if font_size is None:
-            font_size = 12
-
-        center = (root_data.left + root_data.right) / 2
-        if width_label:
-            if width_label_function is not None:
-                label = width_label_function(root_data.width)
-                plot.annotate(
-                    f"{label}",
-                    xy=(center, root_data.height),
-                    xytext=(0, -.3*font_size),
-                    textcoords="offset points",
-                    horizontalalignment="center",
-                    verticalalignment="top",
-                    **label_args,
-                )
-            else:
-                plot.annotate(
-                    f"{root_data.width:.2f}",
-                    xy=(center, root_data.height),
-                    xytext=(0, -.3*font_size),
-                    textcoords="offset points",
-                    horizontalalignment="center",
-                    verticalalignment="top",
-                    **label_args,
-                )
-
-        # useful
-        # https://stackoverflow.com/questions/23344891/matplotlib-set-pad-between-arrow-and-text-in-annotate-function
-        return plot
-
-    def sigma(self, smoothing=None):
-        fwhm = self.full_width_at_level(0.5, smoothing).width
-        return fwhm / 2.355
-
-    def fwhm(self, smoothing=None):
-        return self.full_width_at_level(0.5, smoothing).width
-
-    def gaussian_fit(self):
-        # curve_fit expects something more or less centered
-        x_center = self.spline_max().x
-        fwhm_width = self.full_width_at_level(0.5, 0.0001).width
-        left_bound = x_center - fwhm_width * 3
-        right_bound = x_center + fwhm_width * 3
-        left_idx = np.searchsorted(self.bins, left_bound)
-        right_idx = np.searchsorted(self.bins, right_bound)
-
-        x_bias = np.average(self.bins[left_idx:right_idx])
-        x_portion = self.bins[left_idx:right_idx] - x_bias
-        y_portion = self.hist[left_idx:right_idx]
-        popt, pcov = curve_fit(gaussian, x_portion, y_portion)
-        popt[1] = popt[1] + x_bias
-
-        return popt, pcov
-
-    def plot_gaussian_fit(self):
-        popt, pcov = self.gaussian_fit()
-        return self.bins, gaussian(self.bins, *popt)
-
-
-def gaussian(x, amplitude, mean, stddev):
-    return amplitude * np.exp(-(((x - mean) / stddev) ** 2))
-
-
-# def find_nearest(array,value):
-#     idx = np.searchsorted(array, value, side="left")
-#     if idx > 0 and (idx == len(array) or math.fabs(value - array[idx-1]) < math.fabs(value - array[idx])):
-#         return array[idx-1]
-#     else:
-#         return array[idx]
-
-
-def gaussian_background(x, sigma, mu, back, l, r):
-    "d was found by symbolically integrating in mathematica"
-    n = back + (1 / (sigma * np.sqrt(2 * np.pi))) * np.exp(
-        -0.5 * (((x - mu) / sigma) ** 2)
-    )
-    d = 0.5 * (
-        2 * back * (-l + r)
-        + special.erf((-l + mu) / (np.sqrt(2) * sigma))
-        - special.erf((mu - r) / (np.sqrt(2) * sigma))
-    )
-    return n / d
-
-
-class GaussianTool:
-    class gaussian_bg(rv_continuous):
-        "Gaussian distributionwithj Background parameter 'back'"
-
-        def _pdf(self, x, sigma, mu, back):
-            return gaussian_background(x, sigma, mu, back, self.a, self.b)
+import bisect
+import os
+
+import numpy as np
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import math
+
+# scipy is imported inside the functions that use it. It is an optional extra, and
+# importing it here would add most of a second to every `import snsphd`.
+
+
+# in the SNSPD ccommunity, we are often interested in gaussian-like response functions,
+# and their width metrics like FWHM.
+
+# these tools help with fitting of these response functions, and finding width metrics.
+
+RootData = namedtuple("RootData", "width left right height level")
+MaxData = namedtuple("MaxData", "x y")
+SweepData = namedtuple("SweepData", "table knee")
+BinnedFitData = namedtuple("BinnedFitData", "sigma mu back nll success")
+BootstrapData = namedtuple("BootstrapData", "estimate low high samples")
+RebinData = namedtuple("RebinData", "edges counts bins hist")
+WalkData = namedtuple("WalkData", "amplitude peak width counts offset")
+DriftData = namedtuple("DriftData", "width peak centroid counts")
+IntervalData = namedtuple("IntervalData", "width left right fraction")
+BOOTSTRAP_DTYPE = np.dtype(
+    [
+        ("level", float),
+        ("width", float),
+        ("left", float),
+        ("right", float),
+        ("peak", float),
+    ]
+)
+SWEEP_DTYPE = np.dtype(
+    [
+        ("smoothing", float),
+        ("width", float),
+        ("peak_x", float),
+        ("peak_y", float),
+        ("residual", float),
+        ("n_knots", int),
+    ]
+)
+DRIFT_DTYPE = np.dtype(
+    [
+        ("step", int),
+        ("counts", int),
+        ("width", float),
+        ("peak", float),
+        ("centroid", float),
+    ]
+)
+WIDTH_DTYPE = np.dtype(
+    [
+        ("width", float),
+        ("left", float),
+        ("right", float),
+        ("height", float),
+        ("level", float),
+    ]
+)
+
+
+class SplineTool:
+    # Fits and everything derived from them (derivative, critical points, maximum,
+    # widths per level, gaussian fits) are cached per smoothing factor, so repeated
+    # queries while plotting are free. Changing `smoothing` drops the cache.
+
+    def __init__(self, _bins, hist, smoothing=0):
+        if len(_bins) > len(hist):
+            _bins = _bins[:-1]
+        assert len(hist) == len(_bins)
+        self.hist = np.array(hist)
+        self.bins = np.array(_bins)
+        self.y_scale = np.max(hist)
+        self.norm_hist = hist / self.y_scale
+        self.x_scale = self.bins[-1] - self.bins[0]
+        self.norm_bins = self.bins / self.x_scale
+        self._fits = {}
+        self.smoothing = smoothing
+        self._fit(self.smoothing)
+
+    @property
+    def smoothing(self):
+        return self._smoothing
+
+    @smoothing.setter
+    def smoothing(self, value):
+        if value != getattr(self, "_smoothing", None):
+            self._fits = {}
+        self._smoothing = value
+
+    @property
+    def spline(self):
+        return self._fit(self.smoothing)["spline"]
+
+    def _fit(self, smoothing):
+        # cache entry for one smoothing factor, filled in lazily by the methods below
+        fit = self._fits.get(smoothing)
+        if fit is None:
+            from scipy.interpolate import UnivariateSpline
+
+            spline = UnivariateSpline(self.norm_bins, self.norm_hist, s=smoothing)
+            fit = self._fits[smoothing] = {"spline": spline, "widths": {}, "levels": {}}
+        return fit
+
+    def plot_spline(self, plot_bins, smoothing):
+        self.smoothing = smoothing
+        norm_plot_bins = plot_bins / self.x_scale
+        norm_plot_points = self.spline(norm_plot_bins)
+        return plot_bins, norm_plot_points * self.y_scale
+
+    def full_width_at_level(self, level, smoothing=None):
+        if smoothing is not None:
+            self.smoothing = smoothing
+        return self._full_width_at_level(level, self.smoothing)
+
+    def _full_width_at_level(self, level, smoothing):
+        assert level < 1
+        widths = self._fit(smoothing)["widths"]
+        if level not in widths:
+            widths[level] = self._compute_width_at_level(level, smoothing)
+        return widths[level]
+
+    def _compute_width_at_level(self, level, smoothing):
+        # norm_hist goes from 0 to 1, but the max point (1) may not be a good estimate
+        # for the max used for FWHM. Use the max of the spline instead.
+        shifted_level = self._spline_max(smoothing).y * level
+
+        from scipy.interpolate import UnivariateSpline
+
+        spline = UnivariateSpline(
+            self.norm_bins, self.norm_hist - shifted_level, s=smoothing
+        )
+        roots = spline.roots()
+        # print("roots before: ", roots)
+        roots = roots * self.x_scale
+        # print("xscale: ", self.x_scale)
+
+        if len(roots) < 2:
+            raise ValueError(f"There more or less than 2 roots: {roots}")
+            # print("There more or less than 2 roots")
+            # print("The roots are: ", roots)
+            return 1
+        if len(roots) > 2:
+            print(f"There are more than 2 roots. They are: {roots}")
+            root_1 = roots[np.argmax(np.diff(roots))]
+            root_2 = roots[np.argmax(np.diff(roots)) + 1]
+        if len(roots) == 2:
+            root_1 = roots[0]
+            root_2 = roots[1]
+
+        height = self.y_scale * shifted_level
+        return RootData(
+            width=root_2 - root_1, left=root_1, right=root_2, height=height, level=level
+        )
+
+    def widths_at_levels(self, levels, smoothing=None):
+        """Full widths at several levels from a single spline fit.
+
+        Unlike full_width_at_level, the spline is not refit on shifted data for every
+        level. The maximum is found once. B-spline bases sum to one, so the fitted
+        spline minus a level is the same spline with the level subtracted from its
+        coefficients, and FITPACK's sproot finds its roots directly. Returns a
+        structured array (see WIDTH_DTYPE) with one row per level.
+        """
+        if smoothing is not None:
+            self.smoothing = smoothing
+        levels = np.atleast_1d(np.asarray(levels, dtype=float))
+        assert np.all(levels < 1)
+
+        fit = self._fit(self.smoothing)
+        if "tck" not in fit:
+            knots = fit["spline"].get_knots()
+            t = np.concatenate(([knots[0]] * 3, knots, [knots[-1]] * 3))
+            fit["tck"] = t, fit["spline"].get_coeffs()
+        max_y = self.spline_max().y
+
+        widths = np.zeros(len(levels), dtype=WIDTH_DTYPE)
+        for i, level in enumerate(levels):
+            if level not in fit["levels"]:
+                from scipy.interpolate import sproot
+
+                t, c = fit["tck"]
+                # a cubic piece has at most 3 roots
+                roots = sproot((t, c - max_y * level, 3), mest=3 * len(t))
+                root_1, root_2 = _root_pair(roots * self.x_scale)
+                height = self.y_scale * max_y * level
+                fit["levels"][level] = (root_2 - root_1, root_1, root_2, height, level)
+            widths[i] = fit["levels"][level]
+        return widths
+
+    @staticmethod
+    def quadratic_spline_roots(spl):
+        # vectorized version of _quadratic_spline_roots_loop: one spline call for all
+        # interval ends and midpoints, and every quadratic solved in closed form
+        knots = spl.get_knots()
+        a, b = knots[:-1], knots[1:]
+        vals = spl(np.concatenate((knots, (a + b) / 2)))
+        u, w, v = vals[: len(a)], vals[1 : len(knots)], vals[len(knots) :]
+        t = np.stack(_unit_quadratic_roots(u, v, w), axis=1)
+        roots = t * ((b - a) / 2)[:, None] + ((b + a) / 2)[:, None]
+        return roots[~np.isnan(roots)]
+
+    @staticmethod
+    def _quadratic_spline_roots_loop(spl):
+        # reference implementation of quadratic_spline_roots, one interval at a time
+        # from: https://stackoverflow.com/questions/50371298/find-maximum-minimum-of-a-1d-interpolated-function
+        roots = []
+        knots = spl.get_knots()
+        for a, b in zip(knots[:-1], knots[1:]):
+            u, v, w = spl(a), spl((a + b) / 2), spl(b)
+            t = np.roots([u + w - 2 * v, w - u, 2 * v])
+            t = t[np.isreal(t) & (np.abs(t) <= 1)]
+            roots.extend(t * (b - a) / 2 + (b + a) / 2)
+        return np.array(roots)
+
+    def spline_max(self):
+        return self._spline_max(self.smoothing)
+
+    def _spline_max(self, smoothing):
+        fit = self._fit(smoothing)
+        if "max" not in fit:
+            spline = fit["spline"]
+            fit["derivative"] = spline.derivative()
+            cr_pts = self.quadratic_spline_roots(fit["derivative"])
+            cr_pts = np.append(
+                cr_pts, (self.norm_bins[0], self.norm_bins[-1])
+            )  # also check the endpoints of the interval
+            cr_vals = spline(cr_pts)
+            fit["critical_points"] = cr_pts, cr_vals
+            max_index = np.argmax(cr_vals)
+            fit["max"] = MaxData(
+                x=cr_pts[max_index] * self.x_scale, y=cr_vals[max_index]
+            )
+        return fit["max"]
+
+    def plot_width_at_level_arrows(
+        self,
+        plot,
+        level,
+        width_label=True,
+        width_label_function: callable = None,
+        label_args: dict = {"fontsize": 12, "color": "black", "alpha": 1},
+        arrow_args: dict = {"color": "black", "lw": 1.5, "alpha": 1, "ls": "-"},
+    ):
+        root_data = self.full_width_at_level(level)
+        plot.annotate(
+            text="",
+            xy=(root_data.left, root_data.height),
+            xytext=(root_data.right, root_data.height),
+            arrowprops=dict(
+                shrinkA=0,
+                shrinkB=0,
+                patchA=None,
+                patchB=None,
+                arrowstyle="<->",
+                mutation_scale=16, # increase arrow size
+                **arrow_args,
+            ),
+            label=f"full width at {level} max",
+            bbox=dict(pad=0),
+        )
+        font_size = label_args.get("fontsize", 12)
+        if font_size is None:
+            font_size = 12
+
+        center = (root_data.left + root_data.right) / 2
+        if width_label:
+            if width_label_function is not None:
+                label = width_label_function(root_data.width)
+                plot.annotate(
+                    f"{label}",
+                    xy=(center, root_data.height),
+                    xytext=(0, -.3*font_size),
+                    textcoords="offset points",
+                    horizontalalignment="center",
+                    verticalalignment="top",
+                    **label_args,
+                )
+            else:
+                plot.annotate(
+                    f"{root_data.width:.2f}",
+                    xy=(center, root_data.height),
+                    xytext=(0, -.3*font_size),
+                    textcoords="offset points",
+                    horizontalalignment="center",
+                    verticalalignment="top",
+                    **label_args,
+                )
+
+        # useful
+        # https://stackoverflow.com/questions/23344891/matplotlib-set-pad-between-arrow-and-text-in-annotate-function
+        return plot
+
+    def sigma(self, smoothing=None):
+        fwhm = self.full_width_at_level(0.5, smoothing).width
+        return fwhm / 2.355
+
+    def fwhm(self, smoothing=None):
+        return self.full_width_at_level(0.5, smoothing).width
+
+    def gaussian_fit(self, fast=False, refine=False):
+        """Fit `gaussian` to the histogram within 3 FWHM of the spline maximum.
+
+        The default is a nonlinear curve_fit, with the FWHM taken from a second spline
+        fit at smoothing 0.0001. With `fast`, the window comes from the spline that is
+        already fit, and the parameters come from caruana_fit, a linear least-squares
+        fit of log-counts. `refine` then uses those parameters to seed curve_fit.
+        Results are cached like the spline metrics; copies are returned.
+        """
+        gaussian_fits = self._fit(self.smoothing).setdefault("gaussian_fits", {})
+        if (fast, refine) not in gaussian_fits:
+            gaussian_fits[fast, refine] = self._gaussian_fit(fast, refine)
+        popt, pcov = gaussian_fits[fast, refine]
+        return popt.copy(), pcov.copy()
+
+    def _gaussian_fit(self, fast, refine):
+        # curve_fit expects something more or less centered
+        x_center = self.spline_max().x
+        if fast:
+            fwhm_width = self.widths_at_levels([0.5])["width"][0]
+        else:
+            # a separate fit at low smoothing, which leaves self.smoothing alone
+            fwhm_width = self._full_width_at_level(0.5, 0.0001).width
+        left_bound = x_center - fwhm_width * 3
+        right_bound = x_center + fwhm_width * 3
+        left_idx = np.searchsorted(self.bins, left_bound)
+        right_idx = np.searchsorted(self.bins, right_bound)
+
+        p0 = None
+        if fast:
+            popt, pcov = caruana_fit(
+                self.bins[left_idx:right_idx], self.hist[left_idx:right_idx]
+            )
+            if not refine:
+                return popt, pcov
+            p0 = popt.copy()
+
+        from scipy.optimize import curve_fit
+
+        x_bias = np.average(self.bins[left_idx:right_idx])
+        x_portion = self.bins[left_idx:right_idx] - x_bias
+        y_portion = self.hist[left_idx:right_idx]
+        if p0 is not None:
+            p0[1] = p0[1] - x_bias
+        popt, pcov = curve_fit(gaussian, x_portion, y_portion, p0=p0)
+        popt[1] = popt[1] + x_bias
+
+        return popt, pcov
+
+    def plot_gaussian_fit(self):
+        popt, pcov = self.gaussian_fit()
+        return self.bins, gaussian(self.bins, *popt)
+
+
+class BatchSplineTool:
+    """SplineTool for a stack of histograms that share the same bins.
+
+    `hists` has shape (n_hist, n_bins). Every histogram is fit with a cubic spline
+    on one shared knot vector, so all fits are a single banded least-squares solve
+    and all width metrics are found with array operations instead of a python loop
+    over SplineTool objects. Results mirror SplineTool: MaxData/RootData tuples whose
+    fields are arrays of length n_hist.
+
+    By default the knots interpolate the data, which matches SplineTool with
+    smoothing=0. With `smoothing`, the knots are those UnivariateSpline picks for the
+    mean normalized histogram. `knots` (in bin units) sets them explicitly, e.g. from
+    `tool.spline.get_knots() * tool.x_scale` of a representative SplineTool.
+    """
+
+    def __init__(self, _bins, hists, smoothing=None, knots=None):
+        hists = np.atleast_2d(np.asarray(hists, dtype=float))
+        if len(_bins) > hists.shape[1]:
+            _bins = _bins[:-1]
+        assert hists.shape[1] == len(_bins)
+        self.hists = hists
+        self.bins = np.array(_bins, dtype=float)
+        self.y_scale = np.max(hists, axis=1)
+        self.norm_hists = hists / self.y_scale[:, None]
+        self.x_scale = self.bins[-1] - self.bins[0]
+        self.norm_bins = self.bins / self.x_scale
+        self.smoothing = smoothing
+
+        from scipy.interpolate import UnivariateSpline, make_lsq_spline
+
+        if knots is not None:
+            knots = np.asarray(knots, dtype=float) / self.x_scale
+        elif smoothing:
+            knots = UnivariateSpline(
+                self.norm_bins, self.norm_hists.mean(axis=0), s=smoothing
+            ).get_knots()
+        else:
+            # the knots FITPACK uses for an interpolating cubic spline
+            knots = np.concatenate(
+                (self.norm_bins[:1], self.norm_bins[2:-2], self.norm_bins[-1:])
+            )
+        self.knots = knots
+        t = np.concatenate(([knots[0]] * 3, knots, [knots[-1]] * 3))
+        # one BSpline with coefficient shape (n_coeffs, n_hist)
+        self.spline = make_lsq_spline(self.norm_bins, self.norm_hists.T, t, k=3)
+
+        # piecewise polynomial form: derivatives at the left end of every knot
+        # interval, each with shape (n_intervals, n_hist)
+        self._breaks = knots
+        self._h = np.diff(knots)
+        self._d = [self.spline(knots[:-1], nu=m) for m in range(4)]
+        self._d[2] = self._d[2] / 2
+        self._d[3] = self._d[3] / 6
+        self._break_vals = np.concatenate(
+            (self._d[0], self.spline(knots[-1:])), axis=0
+        )
+
+    def __len__(self):
+        return len(self.hists)
+
+    def _piece(self, idx, s, cols=None):
+        # evaluate interval idx[i] of histogram cols[i] (default i) at local
+        # coordinate s[i]
+        if cols is None:
+            cols = np.arange(len(idx))
+        d0, d1, d2, d3 = (d[idx, cols] for d in self._d)
+        return d0 + s * (d1 + s * (d2 + s * d3))
+
+    def plot_spline(self, plot_bins):
+        norm_plot_points = self.spline(plot_bins / self.x_scale).T
+        return plot_bins, norm_plot_points * self.y_scale[:, None]
+
+    def spline_max(self):
+        h = self._h[:, None]
+        d0, d1, d2, d3 = self._d
+        # derivative of every cubic piece at the start, middle and end of its interval
+        u = d1
+        v = d1 + h * (d2 + 3 * d3 * h / 4)
+        w = d1 + h * (2 * d2 + 3 * d3 * h)
+        t1, t2 = _unit_quadratic_roots(u, v, w)
+
+        # candidates: both roots of every interval, plus the endpoints of the data
+        n_int = len(self._h)
+        cr_s = np.concatenate(
+            (
+                (t1 + 1) * h / 2,
+                (t2 + 1) * h / 2,
+                np.zeros((1, len(self))),
+                np.full((1, len(self)), self._h[-1]),
+            )
+        )
+        cr_idx = np.concatenate(
+            (np.arange(n_int), np.arange(n_int), [0, n_int - 1])
+        )
+        d = [np.concatenate((dm, dm, dm[:1], dm[-1:])) for dm in self._d]
+        with np.errstate(invalid="ignore"):
+            cr_vals = d[0] + cr_s * (d[1] + cr_s * (d[2] + cr_s * d[3]))
+        cr_vals = np.where(np.isnan(cr_s), -np.inf, cr_vals)
+
+        max_index = np.argmax(cr_vals, axis=0)
+        cols = np.arange(len(self))
+        self._max_interval = cr_idx[max_index]
+        self._max_s = cr_s[max_index, cols]
+        x = self._breaks[self._max_interval] + self._max_s
+        return MaxData(x=x * self.x_scale, y=cr_vals[max_index, cols])
+
+    def full_width_at_level(self, level, iterations=52, crossings="nearest"):
+        """Width at `level` of each spline maximum.
+
+        Crossings are located from sign changes at the knots and refined by bisection
+        on the cubic piece. With "nearest", the width runs between the nearest
+        crossings on either side of the maximum, and histograms without a crossing on
+        one side get nan. With "widest", it runs between the neighbouring crossings
+        with the largest gap, as in SplineTool, and histograms with fewer than two
+        crossings get nan.
+        """
+        assert level < 1
+        y_max = self.spline_max().y
+        shifted_level = y_max * level
+        if crossings == "widest":
+            return self._widest_width(level, shifted_level, iterations)
+        if crossings != "nearest":
+            raise ValueError(f"Unknown crossing rule {crossings!r}")
+        i_max = self._max_interval
+        s_max = self._max_s
+
+        below = (self._break_vals - shifted_level) < 0
+        index = np.arange(len(self._breaks))[:, None]
+        j = np.where(below & (index <= i_max), index, -1).max(axis=0)
+        k = np.where(below & (index > i_max), index, len(self._breaks)).min(axis=0)
+        has_left = j >= 0
+        has_right = k < len(self._breaks)
+        j = np.where(has_left, j, 0)
+        k_int = np.where(has_right, k - 1, 0)
+
+        # the left crossing rises through the level, the right one falls through it
+        left = self._bisect(
+            j,
+            np.zeros(len(self)),
+            np.where(j == i_max, s_max, self._h[j]),
+            shifted_level,
+            iterations,
+        )
+        right = self._bisect(
+            k_int,
+            np.where(k_int == i_max, s_max, 0),
+            self._h[k_int],
+            shifted_level,
+            iterations,
+        )
+        left = np.where(has_left, self._breaks[j] + left, np.nan) * self.x_scale
+        right = np.where(has_right, self._breaks[k_int] + right, np.nan) * self.x_scale
+
+        height = self.y_scale * shifted_level
+        level = np.full(len(self), level)
+        return RootData(
+            width=right - left, left=left, right=right, height=height, level=level
+        )
+
+    def _widest_width(self, level, shifted_level, iterations):
+        # split every cubic piece at its critical points into monotonic segments,
+        # so that each crossing is a sign change over one segment, even when a piece
+        # crosses the level twice
+        h = self._h[:, None]
+        d0, d1, d2, d3 = self._d
+        t1, t2 = _unit_quadratic_roots(
+            d1, d1 + h * (d2 + 3 * d3 * h / 4), d1 + h * (2 * d2 + 3 * d3 * h)
+        )
+        c1, c2 = (t1 + 1) * h / 2, (t2 + 1) * h / 2
+        pts = np.stack(
+            (
+                np.zeros_like(c1),
+                np.nan_to_num(np.fmin(c1, c2)),
+                np.nan_to_num(np.fmax(c1, c2)),
+                np.broadcast_to(h, c1.shape),
+            ),
+            axis=-1,
+        )  # (n_intervals, n_hist, 4)
+        vals = d0[..., None] + pts * (
+            d1[..., None] + pts * (d2[..., None] + pts * d3[..., None])
+        )
+        above = vals >= shifted_level[:, None]
+        # every crossing, ordered by histogram and then position
+        change = above[..., :-1] != above[..., 1:]
+        cols, idx, seg = np.nonzero(change.transpose(1, 0, 2))
+        s = self._bisect(
+            idx,
+            pts[idx, cols, seg],
+            pts[idx, cols, seg + 1],
+            shifted_level[cols],
+            iterations,
+            cols,
+        )
+        x = (self._breaks[idx] + s) * self.x_scale
+        # widest gap between neighbouring crossings of the same histogram
+        gap = np.where(cols[1:] == cols[:-1], np.diff(x), -np.inf)
+        order = np.lexsort((-gap, cols[:-1]))
+        hist_of_gap, first = np.unique(cols[:-1][order], return_index=True)
+        best = order[first]
+        found = np.isfinite(gap[best])
+        left = np.full(len(self), np.nan)
+        right = np.full(len(self), np.nan)
+        left[hist_of_gap[found]] = x[best[found]]
+        right[hist_of_gap[found]] = x[best[found] + 1]
+
+        height = self.y_scale * shifted_level
+        level = np.full(len(self), level)
+        return RootData(
+            width=right - left, left=left, right=right, height=height, level=level
+        )
+
+    def _bisect(self, idx, lo, hi, target, iterations, cols=None):
+        lo_above = self._piece(idx, lo, cols) >= target
+        for _ in range(iterations):
+            mid = (lo + hi) / 2
+            same = (self._piece(idx, mid, cols) >= target) == lo_above
+            lo = np.where(same, mid, lo)
+            hi = np.where(same, hi, mid)
+        return (lo + hi) / 2
+
+    def sigma(self):
+        return self.fwhm() / 2.355
+
+    def fwhm(self):
+        return self.full_width_at_level(0.5).width
+
+    def gaussian_fit(self):
+        # SplineTool.gaussian_fit(fast=True) for every histogram at once
+        x_center = self.spline_max().x
+        fwhm_width = self.fwhm()
+        window = np.abs(self.bins - x_center[:, None]) <= 3 * fwhm_width[:, None]
+        return caruana_fit(self.bins, self.hists, weights=window)
+
+
+def sweep_smoothing(bins, hist, factors, level=0.5, workers=None):
+    """Fit SplineTool at every smoothing factor in `factors` and tabulate the results.
+
+    `hist` is one histogram or an (n_hist, n_bins) stack on the same `bins`. The table
+    (see SWEEP_DTYPE) has one row per factor, per histogram. Each row holds the full
+    width at `level`, the spline maximum, the residual sum of squares in SplineTool's
+    normalized units, and the number of knots. Widths that cannot be found are nan.
+    `knee` is the factor picked by smoothing_knee. With `workers` > 1 the work is
+    split across a process pool by histogram and, when there are few histograms,
+    also by chunks of factors, so a single histogram uses the whole pool too.
+    """
+    factors = np.asarray(factors, dtype=float)
+    hists = np.atleast_2d(hist)
+    if workers is None or workers <= 1:
+        tables = [_sweep_one(bins, h, factors, level) for h in hists]
+    else:
+        # about 4 tasks per worker, never splitting the factors finer than one each
+        n_split = max(1, min(len(factors), -(-4 * workers // len(hists))))
+        chunks = np.array_split(factors, n_split)
+        task_hists = [h for h in hists for _ in chunks]
+        task_factors = chunks * len(hists)
+        chunksize = max(1, len(task_hists) // (4 * workers))
+        with ProcessPoolExecutor(workers) as pool:
+            parts = list(
+                pool.map(
+                    _sweep_one,
+                    repeat(bins),
+                    task_hists,
+                    task_factors,
+                    repeat(level),
+                    chunksize=chunksize,
+                )
+            )
+        tables = [
+            np.concatenate(parts[i : i + n_split])
+            for i in range(0, len(parts), n_split)
+        ]
+    table = np.stack(tables)
+    knee = smoothing_knee(table)
+    if np.ndim(hist) == 1:
+        return SweepData(table=table[0], knee=knee[0])
+    return SweepData(table=table, knee=knee)
+
+
+def _sweep_one(bins, hist, factors, level):
+    table = np.zeros(len(factors), dtype=SWEEP_DTYPE)
+    for i, factor in enumerate(factors):
+        tool = SplineTool(bins, hist, smoothing=factor)
+        peak = tool.spline_max()
+        try:
+            width = tool.widths_at_levels([level])["width"][0]
+        except ValueError:
+            width = np.nan
+        residual = tool.spline.get_residual()
+        n_knots = len(tool.spline.get_knots())
+        table[i] = (factor, width, peak.x, peak.y, residual, n_knots)
+    return table
+
+
+def smoothing_knee(table):
+    """Smoothing factor past the knee where width and peak position are most stable.
+
+    UnivariateSpline adds knots until the residual reaches the smoothing factor, so
+    the residual itself just tracks the factor. The knot count against log(smoothing)
+    is flat while the spline interpolates the noise, drops while it stops following
+    it, and collapses again once the fit degenerates towards a polynomial. Fits
+    whose knot count is still in the upper half of its log range follow the noise,
+    and fits with no interior knots or no width are degenerate. Among the rest, the
+    knee is the factor where width and peak_x change least per decade of smoothing,
+    relative to the width. That does not depend on where the sweep starts or ends,
+    as long as it covers the drop. `table` is a sweep_smoothing table with one or
+    more rows. Rows without a usable fit give nan.
+    """
+    table = np.atleast_2d(table)
+    factors = table["smoothing"]
+    if factors.shape[1] < 2:
+        return factors[:, 0]
+    positive = factors[factors > 0]
+    floor = positive.min() / 10 if len(positive) else 1.0
+    x = np.log10(np.maximum(factors, floor))
+    n_knots = table["n_knots"]
+    y = np.log10(np.maximum(n_knots, 1).astype(float))
+    width, peak = table["width"], table["peak_x"]
+
+    usable = (n_knots > 2) & np.isfinite(width)
+    y_hi = np.max(np.where(usable, y, -np.inf), axis=1, keepdims=True)
+    y_lo = np.min(np.where(usable, y, np.inf), axis=1, keepdims=True)
+    smoothed = usable & (y <= (y_hi + y_lo) / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dx = np.gradient(x, axis=1)
+        change = (
+            np.abs(np.gradient(width, axis=1) / dx)
+            + np.abs(np.gradient(peak, axis=1) / dx)
+        ) / width
+    change = np.where(smoothed & np.isfinite(change), change, np.inf)
+    rows = np.arange(len(factors))
+    knee_index = np.argmin(change, axis=1)
+    found = np.isfinite(change[rows, knee_index])
+    return np.where(found, factors[rows, knee_index], np.nan)
+
+
+def bootstrap_widths(
+    bins,
+    hist,
+    levels=(0.5,),
+    n_boot=1000,
+    ci=95,
+    method="poisson",
+    smoothing=None,
+    workers=None,
+    chunk_size=256,
+    seed=None,
+    crossings="widest",
+):
+    """Bootstrap confidence intervals for the widths and peak of one histogram.
+
+    All `n_boot` resampled histograms are drawn at once as an (n_boot, n_bins) array.
+    With "poisson" every bin is redrawn independently; with "multinomial" the total
+    count is held fixed. They are analysed with BatchSplineTool in chunks of
+    `chunk_size`, spread over a process pool when `workers` > 1. With `smoothing`,
+    every resample uses the knots SplineTool picks for the original histogram.
+    Returns BootstrapData whose estimate (from the original histogram), low and high
+    (the central `ci` percent interval) are structured arrays (see BOOTSTRAP_DTYPE)
+    with one row per level. `samples` holds every resample, shape (n_boot, n_levels).
+
+    `crossings` is the rule BatchSplineTool.full_width_at_level uses to pick the
+    crossings. The default "widest" is SplineTool's, so without smoothing the
+    estimate is SplineTool(bins, hist).full_width_at_level(level). On noisy,
+    unsmoothed data the spline crosses a level several times, and resampling adds
+    more noise on top. "nearest" then stops at the first noise dip on either side
+    of the maximum. "widest" takes whichever neighbouring pair of crossings is
+    furthest apart, which can be a dip or a short stretch rather than the peak.
+    Either way, many resampled widths fall far below the estimate, and the
+    interval is stretched downwards, often past the estimate itself. With enough
+    smoothing that each flank crosses the level once, the two rules agree and the
+    interval describes the peak. sweep_smoothing helps to pick the factor.
+    """
+    hist = np.asarray(hist, dtype=float)
+    levels = np.atleast_1d(np.asarray(levels, dtype=float))
+    rng = np.random.default_rng(seed)
+    if method == "poisson":
+        resampled = rng.poisson(hist, size=(n_boot, len(hist)))
+    elif method == "multinomial":
+        total = int(round(hist.sum()))
+        resampled = rng.multinomial(total, hist / hist.sum(), size=n_boot)
+    else:
+        raise ValueError(f"Unknown resampling method: {method}")
+
+    knots = None
+    if smoothing:
+        tool = SplineTool(bins, hist, smoothing=smoothing)
+        knots = tool.spline.get_knots() * tool.x_scale
+    chunks = [resampled[i : i + chunk_size] for i in range(0, n_boot, chunk_size)]
+    if workers is None or workers <= 1:
+        tables = [
+            _bootstrap_chunk(bins, chunk, levels, knots, crossings) for chunk in chunks
+        ]
+    else:
+        with ProcessPoolExecutor(workers) as pool:
+            tables = list(
+                pool.map(
+                    _bootstrap_chunk,
+                    repeat(bins),
+                    chunks,
+                    repeat(levels),
+                    repeat(knots),
+                    repeat(crossings),
+                )
+            )
+    samples = np.concatenate(tables)
+    estimate = _bootstrap_chunk(bins, hist[None], levels, knots, crossings)[0]
+
+    low = np.zeros(len(levels), dtype=BOOTSTRAP_DTYPE)
+    high = np.zeros(len(levels), dtype=BOOTSTRAP_DTYPE)
+    low["level"] = high["level"] = levels
+    for name in BOOTSTRAP_DTYPE.names[1:]:
+        low[name], high[name] = np.nanpercentile(
+            samples[name], [50 - ci / 2, 50 + ci / 2], axis=0
+        )
+    return BootstrapData(estimate=estimate, low=low, high=high, samples=samples)
+
+
+def _bootstrap_chunk(bins, hists, levels, knots, crossings):
+    tool = BatchSplineTool(bins, hists, knots=knots)
+    table = np.zeros((len(hists), len(levels)), dtype=BOOTSTRAP_DTYPE)
+    table["peak"] = tool.spline_max().x[:, None]
+    for i, level in enumerate(levels):
+        root_data = tool.full_width_at_level(level, crossings=crossings)
+        table["level"][:, i] = level
+        table["width"][:, i] = root_data.width
+        table["left"][:, i] = root_data.left
+        table["right"][:, i] = root_data.right
+    return table
+
+
+def crop_and_rebin(
+    bins, hist, level=1e-3, pad=1.0, growth=2.0, max_merge=1024, smooth=5
+):
+    """Shrink a very finely binned histogram to a size set by its peak.
+
+    The region of interest is the run of bins around the maximum where the counts,
+    after a `smooth`-bin moving average, stay above `level` times the peak. It is then
+    widened by `pad` times its own width on each side. Bins inside it keep their
+    native width. Outside it, bins are merged into groups that grow by a factor of
+    `growth` per step away from the region, up to `max_merge` native bins. Counts are
+    summed, so the total is preserved. Input bins are assumed uniform.
+
+    Returns RebinData. `edges` and `counts` describe the variable-width histogram.
+    `bins` and `hist` are ready for SplineTool: every bin's counts per native bin,
+    placed where a native bin centred on it would have its left edge. That keeps the
+    shape and the x convention of the region of interest unchanged.
+    """
+    hist = np.asarray(hist, dtype=float)
+    edges = _as_edges(bins, len(hist))
+    n = len(hist)
+
+    smoothed = np.convolve(hist, np.ones(smooth) / smooth, mode="same")
+    peak = np.argmax(smoothed)
+    below = smoothed < level * smoothed[peak]
+    index = np.arange(n)
+    roi_lo = np.max(index[:peak][below[:peak]], initial=-1) + 1
+    roi_hi = np.min(index[peak:][below[peak:]], initial=n)
+    extra = int(pad * (roi_hi - roi_lo))
+    roi_lo, roi_hi = max(roi_lo - extra, 0), min(roi_hi + extra, n)
+
+    # group sizes growing geometrically away from the region of interest
+    n_grow = int(np.ceil(np.log(max_merge) / np.log(growth))) + 1
+    grow = np.minimum(np.round(growth ** np.arange(n_grow)), max_merge).astype(int)
+    tail = max(roi_lo, n - roi_hi)
+    n_flat = max(0, -(-(tail - grow.sum()) // max_merge))
+    sizes = np.concatenate((grow, np.full(n_flat, max_merge, dtype=int)))
+    offsets = np.cumsum(sizes)
+    left_starts = roi_lo - offsets[offsets < roi_lo][::-1]
+    right_starts = roi_hi + np.concatenate(([0], offsets[offsets < n - roi_hi]))
+    starts = np.concatenate(([0], left_starts, np.arange(roi_lo, roi_hi)))
+    if roi_hi < n:
+        starts = np.concatenate((starts, right_starts))
+    starts = np.unique(starts)
+
+    counts = np.add.reduceat(hist, starts)
+    new_edges = np.append(edges[starts], edges[-1])
+    native = np.diff(np.append(starts, n))
+    native_width = (edges[-1] - edges[0]) / n
+    centers = (new_edges[:-1] + new_edges[1:]) / 2
+    return RebinData(
+        edges=new_edges,
+        counts=counts,
+        bins=centers - native_width / 2,
+        hist=counts / native,
+    )
+
+
+# spline-free width metrics for screening many histograms before the spline fits.
+# Both work on one histogram or an (n_hist, n_bins) stack in a few array passes.
+
+
+def central_width(bins, hists, fraction=0.68):
+    """Width of the central interval holding `fraction` of the counts.
+
+    The interval runs from the (1 - fraction) / 2 to the (1 + fraction) / 2
+    quantile of the counts, with counts spread uniformly within each bin. `bins` are
+    edges or left edges of uniform bins. Quantiles of all rows are found with one
+    np.searchsorted on the flattened cumulative sums, offset by row so they stay
+    sorted. Returns IntervalData, with arrays for stacks.
+    """
+    hists = np.asarray(hists, dtype=float)
+    single = hists.ndim == 1
+    hists = np.atleast_2d(hists)
+    n_hist, n_bins = hists.shape
+    edges = _as_edges(bins, n_bins)
+
+    cdf = np.cumsum(hists, axis=1)
+    cdf /= cdf[:, -1:]
+    rows = 2 * np.arange(n_hist)[:, None]
+    targets = np.array([(1 - fraction) / 2, (1 + fraction) / 2]) + rows
+    flat = np.searchsorted((cdf + rows).ravel(), targets.ravel(), side="left")
+    row_idx = np.repeat(np.arange(n_hist), 2)
+    j = np.minimum(flat - row_idx * n_bins, n_bins - 1)
+    prev = np.where(j > 0, cdf[row_idx, j - 1], 0)
+    mass = cdf[row_idx, j] - prev
+    with np.errstate(invalid="ignore", divide="ignore"):
+        within = np.clip((targets.ravel() - row_idx * 2 - prev) / mass, 0, 1)
+    x = (edges[j] + within * np.diff(edges)[j]).reshape(n_hist, 2)
+
+    result = IntervalData(
+        width=x[:, 1] - x[:, 0],
+        left=x[:, 0],
+        right=x[:, 1],
+        fraction=np.full(n_hist, fraction),
+    )
+    if single:
+        return IntervalData(*(field[0] for field in result))
+    return result
+
+
+def linear_fwhm(bins, hists, level=0.5):
+    """Full width at `level` of the maximum bin, by linear interpolation.
+
+    The crossings are the nearest ones on either side of the maximum bin, linearly
+    interpolated between bin values. `bins` follows SplineTool: left edges (or edges,
+    the last of which is dropped). Histograms without a crossing on one side get
+    nan. Returns RootData, with arrays for stacks.
+    """
+    hists = np.asarray(hists, dtype=float)
+    single = hists.ndim == 1
+    hists = np.atleast_2d(hists)
+    n_hist, n_bins = hists.shape
+    x = np.asarray(bins, dtype=float)[:n_bins]
+    rows = np.arange(n_hist)
+
+    i_max = np.argmax(hists, axis=1)
+    height = hists[rows, i_max] * level
+    below = hists < height[:, None]
+    index = np.arange(n_bins)
+    left_side = below & (index < i_max[:, None])
+    right_side = below & (index > i_max[:, None])
+    # last bin below the level before the maximum, first one after it
+    j = n_bins - 1 - np.argmax(left_side[:, ::-1], axis=1)
+    k = np.argmax(right_side, axis=1)
+    has_left = left_side[rows, j]
+    has_right = right_side[rows, k]
+    j1 = np.minimum(j + 1, n_bins - 1)
+    k0 = np.maximum(k - 1, 0)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        left = x[j] + (height - hists[rows, j]) / (
+            hists[rows, j1] - hists[rows, j]
+        ) * (x[j1] - x[j])
+        right = x[k0] + (hists[rows, k0] - height) / (
+            hists[rows, k0] - hists[rows, k]
+        ) * (x[k] - x[k0])
+    left = np.where(has_left, left, np.nan)
+    right = np.where(has_right, right, np.nan)
+
+    result = RootData(
+        width=right - left,
+        left=left,
+        right=right,
+        height=height,
+        level=np.full(n_hist, level),
+    )
+    if single:
+        return RootData(*(field[0] for field in result))
+    return result
+
+
+def _root_pair(roots):
+    # neighbouring roots with the largest gap between them, as in full_width_at_level
+    if len(roots) < 2:
+        raise ValueError(f"There more or less than 2 roots: {roots}")
+    i = np.argmax(np.diff(roots))
+    return roots[i], roots[i + 1]
+
+
+def _unit_quadratic_roots(u, v, w):
+    # closed form version of the np.roots call in SplineTool.quadratic_spline_roots:
+    # roots in [-1, 1] of the quadratic through (-1, u), (0, v), (1, w).
+    # Works elementwise on arrays; nan marks a missing root.
+    a = u + w - 2 * v
+    b = w - u
+    c = 2 * v
+    with np.errstate(divide="ignore", invalid="ignore"):
+        q = -0.5 * (b + np.copysign(np.sqrt(b * b - 4 * a * c), b))
+        t1 = q / a
+        t2 = c / q
+    t1 = np.where(np.abs(t1) <= 1, t1, np.nan)
+    t2 = np.where(np.abs(t2) <= 1, t2, np.nan)
+    return t1, t2
+
+
+def gaussian(x, amplitude, mean, stddev):
+    return amplitude * np.exp(-(((x - mean) / stddev) ** 2))
+
+
+def caruana_fit(x, y, weights=None):
+    """Closed-form `gaussian` parameters from a linear fit of log-counts.
+
+    Caruana's method: fit log(y) = a + b*x + c*x**2 by weighted linear least squares
+    and convert (a, b, c) to (amplitude, mean, stddev). Each point is weighted by its
+    squared counts (Guo's weighting), so low-count tails and background do not pull
+    the fit, and points with y <= 0 are skipped. `y` is one histogram or an
+    (n_hist, n_bins) stack on the same `x`. The optional `weights` (broadcastable to
+    y) multiply those weights, e.g. a 0/1 window. Returns popt and pcov like
+    curve_fit, with a leading n_hist axis for stacks. pcov propagates the Poisson
+    errors of the counts (var(log y) = 1/y) through the weighted fit.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    w = np.where(y > 0, y**2, 0.0)
+    if weights is not None:
+        w = w * weights
+    log_y = np.log(np.where(y > 0, y, 1.0))
+
+    # center x per histogram to keep the normal equations well conditioned
+    x_bias = (w @ x) / np.sum(w, axis=1)
+    xc = x - x_bias[:, None]
+    w_var = w**2 / np.where(y > 0, y, 1.0)
+    s = [np.sum(w * xc**k, axis=1) for k in range(5)]
+    m = [np.sum(w_var * xc**k, axis=1) for k in range(5)]
+    t = [np.sum(w * xc**k * log_y, axis=1) for k in range(3)]
+    normal = np.stack([np.stack(s[i : i + 3], axis=-1) for i in range(3)], axis=-2)
+    middle = np.stack([np.stack(m[i : i + 3], axis=-1) for i in range(3)], axis=-2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normal_inv = np.linalg.inv(normal)
+        a, b, c = np.einsum("nij,nj->in", normal_inv, np.stack(t, axis=-1))
+        # sandwich covariance, since the weights are not the inverse variances
+        cov_abc = normal_inv @ middle @ normal_inv
+
+        amplitude = np.exp(a - b**2 / (4 * c))
+        mean = -b / (2 * c)
+        stddev = np.sqrt(-1 / c)
+        zero = np.zeros_like(a)
+        d_amplitude = [
+            amplitude,
+            -amplitude * b / (2 * c),
+            amplitude * b**2 / (4 * c**2),
+        ]
+        jac = np.stack(
+            [
+                np.stack(d_amplitude, axis=-1),
+                np.stack([zero, -1 / (2 * c), b / (2 * c**2)], axis=-1),
+                np.stack([zero, zero, 0.5 * (-c) ** -1.5], axis=-1),
+            ],
+            axis=-2,
+        )
+    popt = np.stack([amplitude, mean + x_bias, stddev], axis=-1)
+    pcov = jac @ cov_abc @ np.swapaxes(jac, -1, -2)
+    if single:
+        return popt[0], pcov[0]
+    return popt, pcov
+
+
+# def find_nearest(array,value):
+#     idx = np.searchsorted(array, value, side="left")
+#     if idx > 0 and (idx == len(array) or math.fabs(value - array[idx-1]) < math.fabs(value - array[idx])):
+#         return array[idx-1]
+#     else:
+#         return array[idx]
+
+
+def gaussian_background(x, sigma, mu, back, l, r):
+    "d was found by symbolically integrating in mathematica"
+    from scipy import special
+
+    n = back + (1 / (sigma * np.sqrt(2 * np.pi))) * np.exp(
+        -0.5 * (((x - mu) / sigma) ** 2)
+    )
+    d = 0.5 * (
+        2 * back * (-l + r)
+        + special.erf((-l + mu) / (np.sqrt(2) * sigma))
+        - special.erf((mu - r) / (np.sqrt(2) * sigma))
+    )
+    return n / d
+
+
+def emg(x, amplitude, mu, sigma, tau):
+    """Exponentially modified gaussian: a normal(mu, sigma) convolved with an
+    exponential tail of time constant tau, with total area `amplitude`."""
+    lam = 1 / tau
+    tail, _ = _emg_tail(x, mu, sigma, lam)
+    return amplitude * lam / 2 * tail
+
+
+def emg_jac(x, amplitude, mu, sigma, tau):
+    # analytic derivatives of emg with respect to (amplitude, mu, sigma, tau), stacked
+    # on a new last axis. Array parameters of shape (n, 1) give shape (n, len(x), 4).
+    lam = 1 / tau
+    tail, gauss = _emg_tail(x, mu, sigma, lam)
+    g = lam / 2 * tail
+    # derivative of erfc(z) times the exp(...) prefactor, per unit dz
+    d_erfc = -lam / np.sqrt(np.pi) * gauss
+    d_mu = lam * g + d_erfc / (np.sqrt(2) * sigma)
+    d_sigma = lam**2 * sigma * g + d_erfc * (
+        (x - mu) / (np.sqrt(2) * sigma**2) + lam / np.sqrt(2)
+    )
+    d_lam = g / lam + g * (mu - x + lam * sigma**2) + d_erfc * sigma / np.sqrt(2)
+    d_tau = -(lam**2) * d_lam
+    return np.stack(
+        np.broadcast_arrays(
+            g, amplitude * d_mu, amplitude * d_sigma, amplitude * d_tau
+        ),
+        axis=-1,
+    )
+
+
+def _emg_tail(x, mu, sigma, lam):
+    # exp(a) * erfc(z) of the emg, and the gaussian factor exp(a - z**2). For z >= 0
+    # it is evaluated as gaussian * erfcx(z) so that neither factor overflows.
+    from scipy import special
+
+    z = (mu + lam * sigma**2 - x) / (np.sqrt(2) * sigma)
+    gauss = np.exp(-0.5 * ((x - mu) / sigma) ** 2)
+    a = lam * (mu - x) + 0.5 * (lam * sigma) ** 2
+    z, gauss, a = np.broadcast_arrays(z, gauss, a)
+    tail = np.empty(z.shape)
+    upper = z >= 0
+    tail[upper] = gauss[upper] * special.erfcx(z[upper])
+    tail[~upper] = np.exp(a[~upper]) * special.erfc(z[~upper])
+    return tail, gauss
+
+
+def double_gaussian_tail(
+    x, amplitude_1, mu_1, sigma_1, amplitude_2, mu_2, sigma_2, tau
+):
+    """A narrow gaussian core plus a second gaussian carrying an exponential tail.
+
+    The first component is a normal(mu_1, sigma_1) of area amplitude_1; the second is
+    emg(x, amplitude_2, mu_2, sigma_2, tau).
+    """
+    core = amplitude_1 * _normal(x, mu_1, sigma_1)
+    return core + emg(x, amplitude_2, mu_2, sigma_2, tau)
+
+
+def double_gaussian_tail_jac(
+    x, amplitude_1, mu_1, sigma_1, amplitude_2, mu_2, sigma_2, tau
+):
+    # analytic derivatives of double_gaussian_tail, stacked like emg_jac
+    normal = _normal(x, mu_1, sigma_1)
+    core = np.stack(
+        np.broadcast_arrays(
+            normal,
+            amplitude_1 * normal * (x - mu_1) / sigma_1**2,
+            amplitude_1 * normal * ((x - mu_1) ** 2 / sigma_1**3 - 1 / sigma_1),
+        ),
+        axis=-1,
+    )
+    tail = emg_jac(x, amplitude_2, mu_2, sigma_2, tau)
+    shape = np.broadcast_shapes(core.shape[:-1], tail.shape[:-1])
+    core = np.broadcast_to(core, shape + (3,))
+    tail = np.broadcast_to(tail, shape + (4,))
+    return np.concatenate((core, tail), axis=-1)
+
+
+def _normal(x, mu, sigma):
+    return np.exp(-0.5 * ((x - mu) / sigma) ** 2) / (sigma * np.sqrt(2 * np.pi))
+
+
+def emg_guess(x, y):
+    """Method-of-moments starting values (amplitude, mu, sigma, tau) for emg.
+
+    Works on one curve or an (n, len(x)) stack; the tail time comes from the third
+    central moment, which assumes little flat background.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    dx = np.gradient(x)
+    area = y @ dx
+    weights = y * dx / area[:, None]
+    mean = weights @ x
+    centered = x - mean[:, None]
+    variance = np.sum(weights * centered**2, axis=1)
+    skew = np.sum(weights * centered**3, axis=1)
+    std = np.sqrt(variance)
+    tau = np.clip(np.cbrt(skew / 2), 0.05 * std, 0.9 * std)
+    sigma = np.sqrt(variance - tau**2)
+    guess = np.stack((area, mean - tau, sigma, tau), axis=-1)
+    return guess[0] if single else guess
+
+
+def batch_curve_fit(f, jac, x, ydata, p0, sigma=None, max_iter=200, tol=1e-8):
+    """Levenberg-Marquardt fits of `f` to many curves that share `x`.
+
+    A batched counterpart of curve_fit for models with an analytic `jac` (such as
+    emg/emg_jac or double_gaussian_tail/double_gaussian_tail_jac). `ydata` is one
+    curve or an (n, len(x)) stack and `p0` is one parameter vector or one per curve.
+    Every iteration evaluates the model and Jacobian for all curves still running
+    and solves their small normal equations together. `sigma` weights residuals as
+    in curve_fit, e.g. sqrt(counts) for histograms. A fit stops when its chi-square
+    improves by less than `tol` relative. Returns popt and pcov like curve_fit
+    (pcov is scaled by the reduced chi-square), with a leading axis for stacks.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(ydata, dtype=float)
+    single = y.ndim == 1
+    y = np.atleast_2d(y)
+    n_fits = len(y)
+    params = np.array(np.broadcast_to(p0, (n_fits, np.shape(p0)[-1])), dtype=float)
+    if sigma is None:
+        weights = np.ones_like(y)
+    else:
+        weights = np.broadcast_to(1 / np.asarray(sigma, dtype=float) ** 2, y.shape)
+
+    def chi2(p, idx):
+        with np.errstate(all="ignore"):
+            r = y[idx] - f(x, *p.T[..., None])
+        return np.sum(weights[idx] * r**2, axis=1), r
+
+    damping = np.full(n_fits, 1e-3)
+    done = np.zeros(n_fits, dtype=bool)
+    cost, resid = chi2(params, np.arange(n_fits))
+    for _ in range(max_iter):
+        idx = np.flatnonzero(~done)
+        if len(idx) == 0:
+            break
+        p, r = params[idx], resid[idx]
+        J = jac(x, *p.T[..., None])
+        JtW = np.swapaxes(J * weights[idx, :, None], 1, 2)
+        A = JtW @ J
+        g = (JtW @ r[..., None])[..., 0]
+        diag = np.einsum("nii->ni", A)
+        step = np.linalg.solve(
+            A + (damping[idx, None] * diag)[..., None] * np.eye(A.shape[-1]),
+            g[..., None],
+        )[..., 0]
+        trial_cost, trial_resid = chi2(p + step, idx)
+        better = trial_cost < cost[idx]
+        change = (cost[idx] - trial_cost) / np.maximum(cost[idx], np.finfo(float).tiny)
+        params[idx[better]] = p[better] + step[better]
+        resid[idx[better]] = trial_resid[better]
+        done[idx[better & (change < tol)]] = True
+        cost[idx[better]] = trial_cost[better]
+        damping[idx] = np.where(better, damping[idx] / 10, damping[idx] * 10)
+        done[idx[damping[idx] > 1e16]] = True
+
+    J = jac(x, *params.T[..., None])
+    A = np.swapaxes(J * weights[..., None], 1, 2) @ J
+    dof = max(len(x) - params.shape[1], 1)
+    pcov = np.linalg.pinv(A) * (cost / dof)[:, None, None]
+    if single:
+        return params[0], pcov[0]
+    return params, pcov
+
+
+# convolution with a measured reference IRF, e.g. to separate detector jitter from
+# laser and electronics jitter. Everything goes through one zero-padded FFT, so cost
+# is O(n log n) in the number of bins and a stack of histograms shares one kernel.
+
+
+def fft_convolve(hists, reference, origin=None, axis=-1):
+    """Convolve one histogram or a stack of them with a reference IRF.
+
+    `reference` is on the same bin width as `hists` and is normalized to unit sum,
+    so counts are preserved. Bin `origin` of the reference (default: its maximum) is
+    treated as zero delay, so features stay where they are instead of shifting by
+    the reference's offset. The convolution is linear, not circular, and the result
+    has the shape of `hists`. `axis` is the bin axis.
+    """
+    from scipy import fft
+
+    hists = np.moveaxis(np.asarray(hists, dtype=float), axis, -1)
+    n_bins = hists.shape[-1]
+    kernel, n_fft = _kernel_spectrum(reference, n_bins, origin)
+    out = fft.irfft(fft.rfft(hists, n_fft, axis=-1) * kernel, n_fft, axis=-1)
+    return np.moveaxis(out[..., :n_bins], -1, axis)
+
+
+def wiener_deconvolve(hists, reference, noise=1e-3, origin=None):
+    """Wiener deconvolution of one histogram or a stack of them by a reference IRF.
+
+    The inverse of fft_convolve, with the division by the reference spectrum K
+    regularized as conj(K) / (|K|^2 + noise * max|K|^2). `noise` is the
+    noise-to-signal power ratio. Larger values suppress more of the high-frequency
+    noise that a plain division would amplify, at the cost of resolution. The result
+    can dip below zero where the counts are low.
+    """
+    from scipy import fft
+
+    hists = np.asarray(hists, dtype=float)
+    n_bins = hists.shape[-1]
+    kernel, n_fft = _kernel_spectrum(reference, n_bins, origin)
+    power = np.abs(kernel) ** 2
+    inverse = np.conj(kernel) / (power + noise * power.max())
+    out = fft.irfft(fft.rfft(hists, n_fft, axis=-1) * inverse, n_fft, axis=-1)
+    return out[..., :n_bins]
+
+
+def _kernel_spectrum(reference, n_bins, origin):
+    # spectrum of the unit-sum reference with bin `origin` moved to index 0, and the
+    # padded length that keeps a linear convolution with n_bins bins from wrapping
+    from scipy import fft
+
+    reference = np.asarray(reference, dtype=float)
+    if origin is None:
+        origin = int(np.argmax(reference))
+    n_fft = fft.next_fast_len(n_bins + len(reference) - 1, real=True)
+    kernel = np.zeros(n_fft)
+    kernel[: len(reference) - origin] = reference[origin:]
+    if origin:
+        kernel[-origin:] = reference[:origin]
+    return fft.rfft(kernel / reference.sum()), n_fft
+
+
+def convolved_curve_fit(f, x, ydata, reference, p0, origin=None, jac=None, **kwargs):
+    """Fit `f` convolved with a reference IRF to histogram counts.
+
+    The model evaluated at every bin in `x` (uniform bins, the same width as
+    `reference`) is passed through fft_convolve inside the objective, so the fitted
+    parameters describe the response before convolution. Without `jac` this is
+    curve_fit on one histogram. With `jac` (e.g. emg_jac) it is batch_curve_fit, and
+    `ydata` may be a stack. Fix parameters such as the support of
+    gaussian_background by keyword, e.g.
+    functools.partial(gaussian_background, l=x[0], r=x[-1]). Other keyword
+    arguments go to the fitter. Returns popt and pcov.
+    """
+
+    def model(x, *params):
+        return fft_convolve(f(x, *params), reference, origin)
+
+    if jac is None:
+        from scipy.optimize import curve_fit
+
+        return curve_fit(model, x, ydata, p0=p0, **kwargs)
+
+    def model_jac(x, *params):
+        return fft_convolve(jac(x, *params), reference, origin, axis=-2)
+
+    return batch_curve_fit(model, model_jac, x, ydata, p0, **kwargs)
+
+
+class _GaussianBgClass:
+    # GaussianTool.gaussian_bg subclasses scipy.stats.rv_continuous, so it is only
+    # defined on first access. It then replaces this descriptor on the class.
+    def __get__(self, instance, owner):
+        from scipy.stats import rv_continuous
+
+        class gaussian_bg(rv_continuous):
+            "Gaussian distributionwithj Background parameter 'back'"
+
+            def _pdf(self, x, sigma, mu, back):
+                return gaussian_background(x, sigma, mu, back, self.a, self.b)
+
+        gaussian_bg.__qualname__ = f"{owner.__qualname__}.gaussian_bg"
+        owner.gaussian_bg = gaussian_bg
+        return gaussian_bg
+
+
+class GaussianTool:
+    gaussian_bg = _GaussianBgClass()
+
+    @staticmethod
+    def binned_fit(bins, counts, p0=None, max_iter=100, tol=1e-12):
+        """Binned Poisson maximum-likelihood fit of gaussian_background.
+
+        `counts` is one histogram or an (n_hist, n_bins) stack on the same `bins`
+        (edges, or left edges of uniform bins). The support [l, r] of
+        gaussian_background is the full range of the edges. The likelihood uses the
+        exact integral of the model over each bin. It is maximized by Gauss-Newton
+        steps with analytic gradients and a backtracking line search, run on all
+        histograms of a stack at once. A fit stops when the expected decrease of the
+        negative log-likelihood falls below `tol` times its magnitude, which stays
+        above rounding noise for any number of counts. `p0` holds optional
+        (sigma, mu, back) starting values. Returns BinnedFitData of the fitted sigma,
+        mu and back, the negative log-likelihood (up to a constant) and whether each
+        fit converged.
+        """
+        counts = np.asarray(counts, dtype=float)
+        single = counts.ndim == 1
+        counts = np.atleast_2d(counts)
+        edges = _as_edges(bins, counts.shape[1])
+
+        # fit in units where the edges span [0, 1]
+        x0, length = edges[0], edges[-1] - edges[0]
+        norm_edges = (edges - x0) / length
+        if p0 is None:
+            params = np.stack(_gaussian_background_guess(norm_edges, counts), axis=-1)
+        else:
+            sigma, mu, back = np.broadcast_to(
+                np.asarray(p0, dtype=float), (len(counts), 3)
+            ).T
+            params = np.stack((sigma / length, (mu - x0) / length, back * length), -1)
+
+        nll = _gaussian_background_binned_nll(params, norm_edges, counts)
+        converged = np.zeros(len(counts), dtype=bool)
+        failed = np.zeros(len(counts), dtype=bool)
+        for _ in range(max_iter):
+            active = np.flatnonzero(~(converged | failed))
+            if len(active) == 0:
+                break
+            p, c = params[active], counts[active]
+            old_nll, grad, curvature = _gaussian_background_binned_nll(
+                p, norm_edges, c, derivatives=True
+            )
+            # hold back at zero while the likelihood pushes it negative
+            pinned = (p[:, 2] <= 0) & (grad[:, 2] > 0)
+            grad[pinned, 2] = 0
+            curvature[pinned, 2, :] = 0
+            curvature[pinned, :, 2] = 0
+            curvature[pinned, 2, 2] = 1
+            # give up on fits whose derivatives are no longer finite
+            bad = ~(np.isfinite(grad).all(1) & np.isfinite(curvature).all((1, 2)))
+            failed[active[bad]] = True
+            grad[bad], curvature[bad] = 0, np.eye(3)
+            step = (np.linalg.pinv(curvature) @ grad[..., None])[..., 0]
+            # stop once the expected decrease of the nll is negligible next to the
+            # nll itself, which grows with the total counts
+            decrease = np.einsum("ni,ni->n", grad, step) / 2
+            done = decrease <= tol * np.maximum(np.abs(old_nll), 1)
+            converged[active[done & ~bad]] = True
+            done |= bad
+            active, p, step, old_nll = (
+                active[~done], p[~done], step[~done], old_nll[~done]
+            )
+
+            # backtracking line search, only re-evaluating the fits that got worse
+            trial = p - step
+            trial[:, 2] = np.maximum(trial[:, 2], 0)
+            trial_nll = np.full(len(active), np.inf)
+            pending = np.arange(len(active))
+            for _ in range(40):
+                ok = trial[pending, 0] > 0
+                trial_nll[pending[ok]] = _gaussian_background_binned_nll(
+                    trial[pending[ok]], norm_edges, counts[active[pending[ok]]]
+                )
+                pending = pending[~(trial_nll[pending] <= old_nll[pending])]
+                if len(pending) == 0:
+                    break
+                step[pending] /= 2
+                trial[pending] = p[pending] - step[pending]
+                trial[pending, 2] = np.maximum(trial[pending, 2], 0)
+            improved = trial_nll <= old_nll
+            params[active[improved]] = trial[improved]
+            nll[active[improved]] = trial_nll[improved]
+            # no decrease even for tiny steps: at the minimum to numerical precision
+            converged[active[~improved]] = True
+
+        sigma, mu, back = params.T
+        fit = BinnedFitData(
+            sigma=sigma * length,
+            mu=mu * length + x0,
+            back=back / length,
+            nll=nll,
+            success=converged,
+        )
+        if single:
+            return BinnedFitData(*(field[0] for field in fit))
+        return fit
+
+
+def _as_edges(bins, n_bins):
+    # bin edges from either edges or the left edges of uniform bins
+    bins = np.asarray(bins, dtype=float)
+    if len(bins) == n_bins + 1:
+        return bins
+    assert len(bins) == n_bins
+    return np.append(bins, 2 * bins[-1] - bins[-2])
+
+
+def _gaussian_background_guess(edges, counts):
+    centers = (edges[:-1] + edges[1:]) / 2
+    widths = np.diff(edges)
+    peak = counts.max(axis=1, keepdims=True)
+    mu = centers[np.argmax(counts, axis=1)]
+    sigma = np.sum(np.where(counts >= peak / 2, widths, 0), axis=1) / 2.355
+    # background density from the bins well away from the peak. A low percentile
+    # would be 0 for sparse tails, leaving their counts where the model underflows
+    outside = np.abs(centers - mu[:, None]) > 5 * sigma[:, None]
+    n_outside = np.maximum(np.sum(outside * widths, axis=1), np.finfo(float).tiny)
+    floor = np.sum(np.where(outside, counts, 0), axis=1) / n_outside * widths.mean()
+    total = counts.sum(axis=1)
+    background = np.minimum(floor * len(centers), 0.9 * total)
+    back = background / (total - background) / (edges[-1] - edges[0])
+    return sigma, mu, back
+
+
+def _gaussian_background_binned_nll(params, edges, counts, derivatives=False):
+    # Poisson negative log-likelihood of the counts for gaussian_background integrated
+    # over every bin, dropping terms that do not depend on the parameters. With
+    # `derivatives`, also returns its gradient and a Gauss-Newton curvature with
+    # respect to (sigma, mu, back). params has shape (n_hist, 3).
+    from scipy import special
+
+    sigma, mu, back = (p[:, None] for p in params.T)
+    u = (edges - mu) / sigma
+    # Gaussian mass per bin, taken from the nearer tail to avoid cancellation
+    upper = u[:, :1] > 0
+    cdf = np.where(upper, special.ndtr(-u), special.ndtr(u))
+    gauss = np.where(upper, cdf[:, :-1] - cdf[:, 1:], cdf[:, 1:] - cdf[:, :-1])
+    widths = np.diff(edges)
+    model = np.maximum(back * widths + gauss, np.finfo(float).tiny)
+    norm = model.sum(axis=1, keepdims=True)
+    total = counts.sum(axis=1, keepdims=True)
+    nll = -np.sum(counts * np.log(model), axis=1) + total[:, 0] * np.log(norm[:, 0])
+    if not derivatives:
+        return nll
+
+    pdf = np.exp(-0.5 * u**2) / np.sqrt(2 * np.pi)
+    d_model = np.stack(
+        [
+            -np.diff(u * pdf, axis=1) / sigma,
+            -np.diff(pdf, axis=1) / sigma,
+            np.broadcast_to(widths, model.shape),
+        ],
+        axis=-1,
+    )  # (n_hist, n_bins, 3)
+    d_norm = d_model.sum(axis=1, keepdims=True)
+    grad = -np.einsum("nb,nbj->nj", counts / model, d_model) + (
+        total * d_norm[:, 0] / norm
+    )
+    # Gauss-Newton curvature with the observed counts in place of the expected ones,
+    # so that empty bins where the model vanishes do not contribute
+    d_log_prob = d_model / model[..., None] - d_norm / norm[..., None]
+    d_log_prob = np.clip(d_log_prob, -1e100, 1e100)
+    curvature = np.einsum("nb,nbi,nbj->nij", counts, d_log_prob, d_log_prob)
+    return nll, grad, curvature
+
+
+# raw time tags come in far larger numbers than the histograms above. The tools below
+# bin them chunk by chunk, so only the bin counts are ever held in memory.
+
+
+class HistogramAccumulator:
+    """Fixed, uniform bins on [start, stop) that are filled chunk by chunk.
+
+    Give either `n_bins` or `bin_width`. Every chunk passed to `add` is turned into
+    integer bin indices and counted with np.bincount, so memory scales with the
+    number of bins rather than the number of tags. Integer tags with an integer
+    `start` and `bin_width` are binned with integer arithmetic, which keeps full
+    precision for int64 picosecond time tags. A SplineTool of the counts so far is
+    available at any point from `spline_tool`.
+    """
+
+    def __init__(self, start, stop, n_bins=None, bin_width=None):
+        if (n_bins is None) == (bin_width is None):
+            raise ValueError("Specify exactly one of n_bins and bin_width")
+        if bin_width is None:
+            bin_width = (stop - start) / n_bins
+        else:
+            n_bins = int(np.ceil((stop - start) / bin_width))
+        self._integer = float(start).is_integer() and float(bin_width).is_integer()
+        if self._integer:
+            start, bin_width = int(start), int(bin_width)
+        self.start = start
+        self.bin_width = bin_width
+        self.n_bins = n_bins
+        self.stop = start + n_bins * bin_width
+        self.counts = np.zeros(n_bins, dtype=np.int64)
+        self.underflow = 0
+        self.overflow = 0
+
+    @property
+    def edges(self):
+        return self.start + self.bin_width * np.arange(self.n_bins + 1)
+
+    @property
+    def bins(self):
+        return self.edges[:-1]
+
+    @property
+    def centers(self):
+        return self.bins + self.bin_width / 2
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def _indices(self, values):
+        # bin index of every value, in range or not
+        values = np.asarray(values).ravel()
+        if self._integer and values.dtype.kind in "iu":
+            return (values - self.start) // self.bin_width
+        return np.floor((values - self.start) / self.bin_width)
+
+    def _bin(self, values):
+        idx = self._indices(values)
+        inside = (idx >= 0) & (idx < self.n_bins)
+        n_under = int(np.count_nonzero(idx < 0))
+        n_over = int(np.count_nonzero(idx >= self.n_bins))
+        return idx[inside].astype(np.intp), n_under, n_over
+
+    def bin_counts(self, values):
+        """Counts of `values` in these bins, without adding them to the total."""
+        idx, _, _ = self._bin(values)
+        return np.bincount(idx, minlength=self.n_bins)
+
+    def add(self, values):
+        idx, n_under, n_over = self._bin(values)
+        self.counts += np.bincount(idx, minlength=self.n_bins)
+        self.underflow += n_under
+        self.overflow += n_over
+        return self
+
+    def add_counts(self, counts):
+        # merge counts binned elsewhere on the same bins, e.g. by a worker process
+        self.counts += np.asarray(counts, dtype=np.int64)
+        return self
+
+    def reset(self):
+        self.counts[:] = 0
+        self.underflow = 0
+        self.overflow = 0
+
+    def spline_tool(self, smoothing=0):
+        return SplineTool(self.edges, self.counts, smoothing=smoothing)
+
+
+class TimeWalkAccumulator:
+    """2D histogram of delay against pulse amplitude, filled chunk by chunk.
+
+    Each axis is a HistogramAccumulator built from the matching start, stop and
+    n_bins or bin_width arguments. `add` bins a chunk of (delay, amplitude) pairs
+    into one flat np.bincount, so memory scales with the number of bins and any
+    number of events can be streamed through in chunks. `counts` has shape
+    (n_amplitude_bins, n_delay_bins): one delay histogram per amplitude slice.
+    """
+
+    def __init__(
+        self,
+        delay_start,
+        delay_stop,
+        amplitude_start,
+        amplitude_stop,
+        n_delay_bins=None,
+        n_amplitude_bins=None,
+        delay_bin_width=None,
+        amplitude_bin_width=None,
+    ):
+        self.delay = HistogramAccumulator(
+            delay_start, delay_stop, n_delay_bins, delay_bin_width
+        )
+        self.amplitude = HistogramAccumulator(
+            amplitude_start, amplitude_stop, n_amplitude_bins, amplitude_bin_width
+        )
+        self.counts = np.zeros(
+            (self.amplitude.n_bins, self.delay.n_bins), dtype=np.int64
+        )
+        self.outside = 0
+
+    @property
+    def total(self):
+        return int(self.counts.sum())
+
+    def add(self, delays, amplitudes):
+        d_idx = self.delay._indices(delays)
+        a_idx = self.amplitude._indices(amplitudes)
+        inside = (d_idx >= 0) & (d_idx < self.delay.n_bins)
+        inside &= (a_idx >= 0) & (a_idx < self.amplitude.n_bins)
+        flat = a_idx[inside].astype(np.intp) * self.delay.n_bins
+        flat += d_idx[inside].astype(np.intp)
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(
+            self.counts.shape
+        )
+        self.outside += len(inside) - int(np.count_nonzero(inside))
+        return self
+
+    def add_counts(self, counts):
+        self.counts += np.asarray(counts, dtype=np.int64)
+        return self
+
+    def reset(self):
+        self.counts[:] = 0
+        self.outside = 0
+
+    def walk(self, level=0.5, min_counts=100, smoothing=None):
+        """Peak delay and width at `level` of every amplitude slice.
+
+        All slices with at least `min_counts` events are fit in one
+        BatchSplineTool; the others get nan. `offset` is the peak delay relative
+        to the slice with the most counts, which is the curve `correct` removes.
+        Returns WalkData with one entry per amplitude bin.
+        """
+        slice_counts = self.counts.sum(axis=1)
+        used = np.flatnonzero(slice_counts >= min_counts)
+        peak = np.full(self.amplitude.n_bins, np.nan)
+        width = np.full(self.amplitude.n_bins, np.nan)
+        if len(used):
+            tool = BatchSplineTool(
+                self.delay.edges, self.counts[used], smoothing=smoothing
+            )
+            peak[used] = tool.spline_max().x
+            width[used] = tool.full_width_at_level(level).width
+        return WalkData(
+            amplitude=self.amplitude.centers,
+            peak=peak,
+            width=width,
+            counts=slice_counts,
+            offset=peak - peak[np.argmax(slice_counts)],
+        )
+
+    def correct(self, delays, amplitudes, walk=None):
+        """`delays` with the walk offset at each amplitude subtracted.
+
+        The offset is linearly interpolated between the amplitude bin centers that
+        have a fit, and held constant beyond them. `walk` defaults to self.walk().
+        """
+        if walk is None:
+            walk = self.walk()
+        valid = np.isfinite(walk.offset)
+        offset = np.interp(amplitudes, walk.amplitude[valid], walk.offset[valid])
+        return np.asarray(delays) - offset
+
+
+class DriftTracker:
+    """Width and position of a histogram over a sliding window of chunks.
+
+    Each chunk of time differences passed to `update` is binned once with
+    `accumulator.bin_counts` and kept. The accumulator holds the rolling sum of the
+    last `window` chunks: the new chunk's counts are added and the expired chunk's
+    counts subtracted. The cost of a step therefore depends on the chunk size and
+    the number of bins, not on the window length. Each step fits the rolling
+    histogram with SplineTool and reports the width at `level`, the spline peak and
+    the count-weighted centroid of the bin centers. These are nan while the window
+    holds fewer than `min_counts` counts or when the fit fails.
+    """
+
+    def __init__(self, accumulator, window, level=0.5, smoothing=0, min_counts=1):
+        self.accumulator = accumulator
+        self.window = window
+        self.level = level
+        self.smoothing = smoothing
+        self.min_counts = min_counts
+        self._chunks = deque()
+
+    def update(self, values):
+        counts = self.accumulator.bin_counts(values)
+        self.accumulator.add_counts(counts)
+        self._chunks.append(counts)
+        if len(self._chunks) > self.window:
+            self.accumulator.add_counts(-self._chunks.popleft())
+        return self._measure()
+
+    def _measure(self):
+        counts = self.accumulator.counts
+        total = int(counts.sum())
+        width = peak = centroid = np.nan
+        if total >= self.min_counts:
+            centroid = np.dot(self.accumulator.centers, counts) / total
+            try:
+                tool = self.accumulator.spline_tool(self.smoothing)
+                width = tool.widths_at_levels([self.level])["width"][0]
+                peak = tool.spline_max().x
+            except (ValueError, RuntimeError):
+                pass
+        return DriftData(width=width, peak=peak, centroid=centroid, counts=total)
+
+    def track(self, chunks):
+        """Run `update` on every chunk and return the results as a DRIFT_DTYPE array."""
+        rows = []
+        for step, chunk in enumerate(chunks):
+            drift = self.update(chunk)
+            rows.append((step, drift.counts, drift.width, drift.peak, drift.centroid))
+        return np.array(rows, dtype=DRIFT_DTYPE)
+
+
+def iter_timetag_windows(source, window=2**22, dtype=np.int64, offset=0):
+    """Yield consecutive windows of at most `window` tags from a time-tag stream.
+
+    `source` is the path of a flat binary file of tags (`offset` bytes of header are
+    skipped) or an array. Each file window is its own np.memmap, dropped before the
+    next one is mapped, so resident memory stays near one window no matter how large
+    the file is.
+    """
+    n_tags = _n_tags(source, dtype, offset)
+    for i in range(0, n_tags, window):
+        tags = _map_tags(source, i, min(i + window, n_tags), dtype, offset)
+        yield tags
+        del tags
+
+
+def start_stop_histogram(
+    start, stop, accumulator, window=2**22, dtype=np.int64, offset=0
+):
+    """Histogram the delay from each stop tag to the latest start tag before it.
+
+    `start` and `stop` are sorted time-tag streams, as file paths or arrays (see
+    iter_timetag_windows). The stop stream is walked in windows. For each window, only
+    the slice of start tags that can precede it is mapped, located by binary search.
+    Delays are added to `accumulator` (a HistogramAccumulator), which is returned and
+    can hand its counts to SplineTool.
+    """
+    starts = _TagIndex(start, dtype, offset)
+    for stops in iter_timetag_windows(stop, window, dtype, offset):
+        lo = max(bisect.bisect_right(starts, stops[0]) - 1, 0)
+        hi = bisect.bisect_right(starts, stops[-1], lo=lo)
+        ref = _map_tags(start, lo, hi, dtype, offset)
+        accumulator.add(_delays_from_preceding(ref, stops))
+        del ref
+    return accumulator
+
+
+def correlation_histogram(
+    a,
+    b,
+    accumulator,
+    window=2**22,
+    max_pairs=2**24,
+    workers=None,
+    dtype=np.int64,
+    offset=0,
+):
+    """Cross-correlation histogram of two tag streams, e.g. for g2 or coincidences.
+
+    Every pair of an `a` tag and a `b` tag whose delay b - a falls in the range of
+    `accumulator` is counted. `a` and `b` are sorted time-tag streams, as file paths
+    or arrays (see iter_timetag_windows). The matching `b` tags of each `a` tag are
+    located with np.searchsorted, so the cost is O((n + m) log m) plus the number of
+    pairs counted, never the full n * m. `a` is walked in windows of `window` tags,
+    and the pairs of a window are expanded at most `max_pairs` at a time. With
+    `workers`, windows are binned in a process pool. For files each task maps only
+    its own range, while array inputs are sliced and sent to the workers.
+    The counts are added to `accumulator`, which is returned. Its `spline_tool()` and
+    `edges`/`counts` go straight into SplineTool and GaussianTool.binned_fit.
+    """
+    a_index = _TagIndex(a, dtype, offset)
+    b_index = _TagIndex(b, dtype, offset)
+    tasks = []
+    for a_lo in range(0, len(a_index), window):
+        a_hi = min(a_lo + window, len(a_index))
+        b_lo = bisect.bisect_left(b_index, a_index[a_lo] + accumulator.start)
+        b_hi = bisect.bisect_left(
+            b_index, a_index[a_hi - 1] + accumulator.stop, lo=b_lo
+        )
+        parts = (a, a_lo, a_hi), (b, b_lo, b_hi)
+        if isinstance(a, np.ndarray):
+            parts = (a[a_lo:a_hi], 0, a_hi - a_lo), (b[b_lo:b_hi], 0, b_hi - b_lo)
+        tasks.append(parts)
+
+    if workers is None or workers <= 1:
+        counts = (
+            _correlation_counts(a_part, b_part, accumulator, max_pairs, dtype, offset)
+            for a_part, b_part in tasks
+        )
+        for c in counts:
+            accumulator.add_counts(c)
+    else:
+        a_parts, b_parts = zip(*tasks) if tasks else ((), ())
+        with ProcessPoolExecutor(workers) as pool:
+            for c in pool.map(
+                _correlation_counts,
+                a_parts,
+                b_parts,
+                repeat(accumulator),
+                repeat(max_pairs),
+                repeat(dtype),
+                repeat(offset),
+            ):
+                accumulator.add_counts(c)
+    return accumulator
+
+
+def _correlation_counts(a_part, b_part, template, max_pairs, dtype, offset):
+    # binned delays of all pairs between a (source, lo, hi) range of a tags and the
+    # range of b tags that can reach them. template only supplies the bins
+    a = _map_tags(*a_part, dtype, offset)
+    b = _map_tags(*b_part, dtype, offset)
+    counts = np.zeros(template.n_bins, dtype=np.int64)
+    if len(a) == 0 or len(b) == 0:
+        return counts
+    lo = np.searchsorted(b, a + template.start, side="left")
+    n = np.searchsorted(b, a + template.stop, side="left") - lo
+    total = np.cumsum(n)
+    # split the a tags so that each batch expands to at most max_pairs pairs
+    splits = np.searchsorted(total, np.arange(max_pairs, total[-1], max_pairs))
+    for i, j in zip(np.r_[0, splits], np.r_[splits, len(a)]):
+        nn = n[i:j]
+        first = np.cumsum(nn) - nn
+        idx = np.repeat(lo[i:j] - first, nn) + np.arange(nn.sum())
+        counts += template.bin_counts(b[idx] - np.repeat(a[i:j], nn))
+    return counts
+
+
+def fold_to_clock(
+    detector,
+    clock,
+    accumulator,
+    divider=1,
+    recovery=None,
+    n_average=64,
+    gain=0.05,
+    period=None,
+    window=2**22,
+    dtype=np.int64,
+    offset=0,
+):
+    """Histogram detector tags relative to the preceding clock tag, folded into one
+    laser period.
+
+    `detector` and `clock` are sorted time-tag streams, as file paths or arrays (see
+    iter_timetag_windows). The clock channel may record only every `divider`-th
+    laser pulse. Each detector tag is referenced to the latest clock tag before it
+    with np.searchsorted, and folded modulo the local clock spacing divided by
+    `divider`, or modulo `period` if it is given. Tags before the first clock tag
+    are dropped. The detector stream is walked in windows, and for each only the
+    clock tags it can reference are mapped, located by binary search. `recovery`
+    ("average" or "pll") replaces the recorded clock with a smoothed one (see
+    recover_clock) before folding. The clock is then read in windows instead, two
+    passes in all, with the detector tags of each window found by binary search.
+    Memory stays bounded by the window size either way. Delays are added to
+    `accumulator`, which is returned.
+    """
+    n_clock = _n_tags(clock, dtype, offset)
+    if recovery is None:
+        clocks = _TagIndex(clock, dtype, offset)
+        for tags in iter_timetag_windows(detector, window, dtype, offset):
+            lo = max(bisect.bisect_right(clocks, tags[0]) - 1, 0)
+            # one clock tag past the last referenced one, for the spacing
+            hi = min(bisect.bisect_right(clocks, tags[-1], lo=lo) + 1, n_clock)
+            ref = _map_tags(clock, lo, hi, dtype, offset)
+            accumulator.add(_fold_delays(tags, ref, None, divider, period))
+            del ref, tags
+        return accumulator
+
+    detectors = _TagIndex(detector, dtype, offset)
+    chunks = _iter_clock_correction(
+        clock, recovery, n_average, gain, window, dtype, offset
+    )
+    # the last clock tag of every window is carried over, since its spacing needs
+    # the first tag of the next one
+    ref = np.zeros(0, dtype=dtype)
+    correction = np.zeros(0)
+    for lo, clock_part, correction_part in chunks:
+        ref = np.concatenate((ref[-1:], clock_part))
+        correction = np.concatenate((correction[-1:], correction_part))
+        last = lo + len(clock_part) == n_clock
+        d_lo = bisect.bisect_left(detectors, ref[0])
+        if last:
+            d_hi = len(detectors)
+        else:
+            d_hi = bisect.bisect_left(detectors, ref[-1], lo=d_lo)
+        for i in range(d_lo, d_hi, window):
+            tags = _map_tags(detector, i, min(i + window, d_hi), dtype, offset)
+            accumulator.add(_fold_delays(tags, ref, correction, divider, period))
+            del tags
+    return accumulator
+
+
+def _fold_delays(tags, ref, correction, divider, period):
+    # delays of the tags from the latest ref tag before them, folded into one period.
+    # The spacing after a ref tag is taken to the next one, or for the last ref tag
+    # to the previous one. correction is added to ref, or None.
+    idx = np.searchsorted(ref, tags, side="right") - 1
+    valid = idx >= 0
+    idx, tags = idx[valid], tags[valid]
+    delays = tags - ref[idx]
+    if correction is not None:
+        delays = delays - correction[idx]
+    if period is not None:
+        return np.mod(delays, period)
+    j = np.where(idx + 1 < len(ref), idx, idx - 1)
+    spacing = (ref[j + 1] - ref[j]).astype(float)
+    if correction is not None:
+        spacing += correction[j + 1] - correction[j]
+    return np.mod(delays, spacing / divider)
+
+
+def recover_clock(clock, method="average", n_average=64, gain=0.05):
+    """Software clock recovery: a smoothed copy of a jittery clock channel.
+
+    The clock is compared with an ideal one of constant period, fit by least
+    squares. "average" replaces every tag's deviation from it with the centered
+    moving average over `n_average` tags. "pll" tracks the deviation with a causal
+    second-order phase-locked loop of phase gain `gain` and frequency gain
+    gain**2 / 4 (critically damped), like a hardware clock-recovery circuit. Returns
+    float clock times. fold_to_clock applies the same correction to integer tags
+    without the float round trip.
+    """
+    clock = np.asarray(clock)
+    parts = _iter_clock_correction(
+        clock, method, n_average, gain, 2**22, clock.dtype, 0
+    )
+    return clock + np.concatenate([part for _, _, part in parts])
+
+
+def _iter_clock_correction(clock, method, n_average, gain, window, dtype, offset):
+    # recovered clock minus recorded clock, in float, yielded as (lo, tags,
+    # correction) for consecutive windows of the clock stream. It is computed from
+    # the residuals against a constant-period line, so int64 tags never lose
+    # precision. A first pass fits the line; the moving average reads each window
+    # with n_average tags of overlap, and the PLL carries its filter state across.
+    if method not in ("average", "pll"):
+        raise ValueError(f"Unknown clock recovery method {method!r}")
+    n = _n_tags(clock, dtype, offset)
+    first = _map_tags(clock, 0, 1, dtype, offset)[0]
+
+    def residual(lo, hi):
+        tags = _map_tags(clock, lo, hi, dtype, offset)
+        k = np.arange(lo, hi) - k_mean
+        return tags, (tags - first).astype(float) - (intercept + slope * k)
+
+    # least squares line against the centered tag index
+    k_mean = (n - 1) / 2
+    sum_y, sum_ky = 0.0, 0.0
+    for lo in range(0, n, window):
+        tags = _map_tags(clock, lo, min(lo + window, n), dtype, offset)
+        y = (tags - first).astype(float)
+        sum_y += y.sum()
+        sum_ky += np.dot(np.arange(lo, lo + len(y)) - k_mean, y)
+    slope = sum_ky / (n * (n * n - 1) / 12) if n > 1 else 0.0
+    intercept = sum_y / n
+
+    if method == "pll":
+        from scipy.signal import lfilter
+
+        beta = gain**2 / 4
+        b, a = [0, gain, beta - gain], [1, gain - 2, 1 - gain + beta]
+        state = np.zeros(2)
+    kernel = np.ones(n_average)
+    for lo in range(0, n, window):
+        hi = min(lo + window, n)
+        if method == "pll":
+            tags, r = residual(lo, hi)
+            smoothed, state = lfilter(b, a, r, zi=state)
+        else:
+            # np.convolve "same" reaches n_average // 2 tags back and
+            # (n_average - 1) // 2 ahead
+            seg_lo = max(lo - n_average // 2, 0)
+            seg_hi = min(hi + (n_average - 1) // 2, n)
+            tags, r = residual(seg_lo, seg_hi)
+            smoothed = np.convolve(r, kernel, mode="same") / np.convolve(
+                np.ones(len(r)), kernel, mode="same"
+            )
+            inner = slice(lo - seg_lo, hi - seg_lo)
+            tags, r, smoothed = tags[inner], r[inner], smoothed[inner]
+        yield lo, tags, smoothed - r
+
+
+class _TagIndex:
+    # read-only sequence view of a time-tag stream for the bisect module. For files,
+    # every lookup is a single small read: a memmap of the whole file would keep the
+    # kernel's readahead around each probe resident for the rest of the walk.
+    def __init__(self, source, dtype, offset):
+        self.source = source
+        self.dtype = np.dtype(dtype)
+        self.offset = offset
+        self._len = _n_tags(source, dtype, offset)
+
+    def __len__(self):
+        return self._len
+
+    def __getitem__(self, i):
+        if isinstance(self.source, np.ndarray):
+            return self.source[i]
+        position = self.offset + i * self.dtype.itemsize
+        return np.fromfile(self.source, self.dtype, count=1, offset=position)[0]
+
+
+def _n_tags(source, dtype, offset):
+    if isinstance(source, np.ndarray):
+        return len(source)
+    return (os.path.getsize(source) - offset) // np.dtype(dtype).itemsize
+
+
+def _map_tags(source, lo, hi, dtype, offset):
+    # tags [lo, hi) of an array or of a flat binary file, mapping only that range
+    if isinstance(source, np.ndarray):
+        return source[lo:hi]
+    if hi <= lo:
+        return np.zeros(0, dtype=dtype)
+    itemsize = np.dtype(dtype).itemsize
+    return np.memmap(
+        source, dtype=dtype, mode="r", offset=offset + lo * itemsize, shape=(hi - lo,)
+    )
+
+
+def _delays_from_preceding(ref, tags):
+    # delay of every tag from the latest ref tag at or before it; tags with no
+    # preceding ref tag are dropped. Both arrays must be sorted.
+    idx = np.searchsorted(ref, tags, side="right") - 1
+    valid = idx >= 0
+    return tags[valid] - ref[idx[valid]]
@@ -1,178 +1,660 @@
-import orjson
-import numpy as np
-from datetime import datetime
-
-"""
-A custom class for making data objects that are easily exported/imported as json. Uses orjson for fast export and 
-import of numpy arrays. 
-
-The export and import methods can handle DataObj objects inside other DataObj objects. 
-
-Why not just use the pickle library? 
---> Answer: Json is a more universal format than python pickle. The exports from this library could be parsed by Matlab, 
-Javascript, etc. The use of orjson here should also make this much faster than python pickle for large datasets. 
-"""
-
-
-class DataObj:
-    def __init__(self, name=None, dic=None):
-        if name is not None:
-            self.load_file(name)
-        if dic is not None:
-            self.load_dic(dic)
-
-    def export(
-        self, name, include_time=False, print_info=False, include_time_inside=False
-    ):
-        dic = self.export_dic()
-        if include_time:
-            now = datetime.now()
-            dt_string = now.strftime("%d.%m.%Y_%H.%M.%S")
-            name = name + dt_string
-        if include_time_inside:
-            now = datetime.now()
-            dt_string = now.strftime("%d.%m.%Y_%H.%M.%S")
-            dic["date_time"] = dt_string
-        strb = orjson.dumps(dic, option=orjson.OPT_SERIALIZE_NUMPY)
-
-        if name[-5:] != ".json":
-            json_name = name + ".json"
-        else:
-            json_name = name
-        with open(json_name, "wb") as file:
-            file.write(strb)
-        if print_info:
-            print("Saving data as: ", name)
-        return name  # if I want to save other file types with same name
-
-    @classmethod
-    def from_file(cls, name):
-        obj = cls()
-        obj.load_file(name)
-        return obj
-
-
-    def load_file(self, name):
-        with open(name, "rb") as file:
-            strb = file.read()
-        self.load_dic(orjson.loads(strb))
-        print(self.__dict__.keys())
-
-
-    # recursive
-    def check_list(self, item):
-        if type(item) is list:
-            return self.check_list(item[0])
-        if (type(item) is float) or (type(item) is int):
-            return True
-        else:
-            return False
-
-    def load_dic(self, dic):
-
-        dic_2 = dic.copy()
-        for key in dic.keys():
-            # handle numpy arrays
-            # does not working with multi-dimensional numpy arrays yet. 
-            # need recursive check function so that lists of lists of numpy becomes np.array(np.array(np.array))
-            if self.check_list(dic[key]):
-                dic_2[key] = np.array(dic[key])
-
-            # handle lists of objects of type JsonTool
-            if (type(dic[key]) is list) and (key[-3:] == "_do"):
-                ls = dic_2[key]
-                del dic_2[key]
-                for i in range(len(ls)):
-                    ls[i] = DataObj(dic=ls[i])
-                dic_2[key[:-3]] = ls
-                continue
-
-            # handle keys with value of type JsonTool
-            if key[-3:] == "_do":
-                sub_dic = dic[key]
-                del dic_2[key]
-                dic_2[key[:-3]] = DataObj(dic=sub_dic)
-        self.__dict__.update(dic_2)
-
-    def export_dic(self):
-        dic = self.__dict__
-        dic_2 = dic.copy()
-        for key in dic.keys():
-
-            # handle non-continuous numpy arrays
-            if isinstance(dic[key], np.ndarray):
-                is_continuous = dic[key].flags.contiguous
-                # print(is_continuous)
-                if not is_continuous:
-                    dic_2[key] = dic[key].copy(order="C")
-
-
-            if (type(dic[key]) is type(self)) or issubclass(type(dic[key]), type(self)):
-                # dic[key] = dic[key].export_dic()
-                json_tool_dic = dic[key].export_dic()
-                del dic_2[key]
-                new_key = str(key) + "_do"
-                dic_2[new_key] = json_tool_dic
-
-            if (type(dic[key]) is list) and (
-                (type(dic[key][0]) is type(self))
-                or issubclass(type(dic[key][0]), type(self))
-            ):
-                ls = []
-                for i, item in enumerate(dic[key]):
-                    ls.append(dic[key][i].export_dic())
-
-                del dic_2[key]
-                new_key = str(key) + "_do"
-                dic_2[new_key] = ls
-        return dic_2
-
-
-# would be cool if this could overload the list functionality if I only wanted to use this object as a list.
-# right now it does not encode lists of numpy arrays correctly.
-
-
-if __name__ == "__main__":
-    # create a DataObj with various things inside, including a list of DataObj, a single DataObj,
-    # and an extra numpy array.
-    parent = DataObj()
-    parent.items = []
-    # for i in range(20):
-    #     struct = DataObj()
-    #     struct.item = "this is an item"
-    #     struct.dB = f"{i} dB"
-    #     struct.ls = [
-    #         np.array([3, 34, 2, 43]),
-    #         np.array([3, 34, 2, 43]),
-    #         np.array([3, 34, 2, 43]),
-    #     ]
-    #     struct.arr = np.array([23, 2, 34, 2, 43, 3, 4.433])
-    #     parent.items.append(struct)
-    # parent.extraObj = DataObj()
-    # parent.extraObj.item = "this is an item inside an nested DataObj"
-    # parent.numpy = np.array([3, 54, 3, 45, 2, 5, 7, 3])
-    # # export
-    # parent.export("try_this.json")
-
-    # # import
-    # parent_2 = DataObj("try_this.json")
-    # print(type(parent_2))
-    # for item in parent_2.__dict__.keys():
-    #     print(item)
-    # print(parent_2.extraObj.item)
-    # print()
-    # print(parent_2.numpy)
-    # print(type(parent_2.numpy))
-    # print()
-    # print([parent_2.items[i].dB for i in range(10)])
-    # print([parent_2.items[i].arr for i in range(10)])
-    parent.items.append([np.array([4,5,23,45,3,4]),np.array([4,5,23,45,3,4]),np.array([55,5,23,45,3,4])])
-    parent.export("try_this.json")
-    print()
-    parent_2 = DataObj("try_this.json")
-    print(parent_2.items)
-    print(type(parent_2.items))
-    # print(parent.check_numpy(parent.items))
-
-
-
+import base64
+import gzip
+import io
+import lzma
+import mmap
+import os
+import re
+import time
+import orjson
+import numpy as np
+from datetime import datetime
+
+"""
+A custom class for making data objects that are easily exported/imported as json. Uses orjson for fast export and 
+import of numpy arrays. 
+
+The export and import methods can handle DataObj objects inside other DataObj objects. 
+
+Why not just use the pickle library? 
+--> Answer: Json is a more universal format than python pickle. The exports from this library could be parsed by Matlab, 
+Javascript, etc. The use of orjson here should also make this much faster than python pickle for large datasets. 
+"""
+
+
+class DataObj:
+    def __init__(self, name=None, dic=None):
+        if name is not None:
+            self.load_file(name)
+        if dic is not None:
+            self.load_dic(dic)
+
+    def export(
+        self,
+        name,
+        include_time=False,
+        print_info=False,
+        include_time_inside=False,
+        array_threshold=None,
+        typed_arrays=False,
+        compression=None,
+    ):
+        """
+        With array_threshold, numpy arrays with at least that many elements are
+        saved as .npy files in a "<name>_arrays" folder next to the json, with a
+        subfolder per nested object. The json stores their relative path under the
+        key suffix "_npy", and lists them all under the reserved top-level key
+        "_sidecars", so other "_npy" strings still load as strings. They load back
+        as memory maps with no parsing or copy.
+
+        With typed_arrays, the other numpy arrays are stored under the key suffix
+        "_nd" as their dtype, shape and base64-encoded bytes. They load back with
+        exactly that dtype and shape in one np.frombuffer call. Plain json lists
+        stay readable by other languages, but come back as int64/float64.
+
+        compression ("gzip", "lzma" or "zstd", the last if the zstandard package is
+        installed) writes "<name>.json.gz", ".json.xz" or ".json.zst". A name that
+        already ends in one of these selects it too. The json is fed to the
+        compressor in chunks, so no compressed copy of it is held in memory.
+        """
+        if include_time:
+            now = datetime.now()
+            dt_string = now.strftime("%d.%m.%Y_%H.%M.%S")
+            name = name + dt_string
+        name, name_compression = _split_compression(name)
+        compression = compression or name_compression
+        if name[-5:] != ".json":
+            json_name = name + ".json"
+        else:
+            json_name = name
+        sidecar = None
+        if array_threshold is not None:
+            sidecar = _Sidecar(json_name, array_threshold)
+        dic = self.export_dic(sidecar=sidecar, typed_arrays=typed_arrays)
+        if sidecar is not None and sidecar.saved:
+            dic[_SIDECAR_KEY] = sorted(sidecar.saved)
+        if include_time_inside:
+            now = datetime.now()
+            dt_string = now.strftime("%d.%m.%Y_%H.%M.%S")
+            dic["date_time"] = dt_string
+        strb = orjson.dumps(dic, option=orjson.OPT_SERIALIZE_NUMPY)
+
+        if compression is not None:
+            json_name = json_name + _EXTENSIONS[compression]
+        view = memoryview(strb)
+        with _open_file(json_name, "wb", compression) as file:
+            for i in range(0, len(view), _CHUNK_SIZE):
+                file.write(view[i : i + _CHUNK_SIZE])
+        if print_info:
+            print("Saving data as: ", name)
+        return name  # if I want to save other file types with same name
+
+    @classmethod
+    def from_file(cls, name, lazy=False):
+        """
+        With lazy=True the file is memory mapped and only its top-level keys are
+        indexed. Each value is decoded and converted on first attribute access and
+        then cached. Nested "_do" objects are lazy in the same way. Compressed files
+        are decompressed into memory first, and only the decoding is lazy.
+        """
+        obj = cls()
+        if lazy:
+            if _detect_compression(name) is not None:
+                with _open_file(name, "rb") as file:
+                    buffer = file.read()
+            else:
+                with open(name, "rb") as file:
+                    buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            start = _skip_space(buffer, 0)
+            obj._index(buffer, start, os.path.dirname(os.path.abspath(name)))
+        else:
+            obj.load_file(name)
+        return obj
+
+    def _index(self, buffer, start, base_dir, sidecars=None):
+        # record where each value of the json object at `start` is, without decoding.
+        # sidecars as in load_dic
+        members = _json_members(buffer, start)
+        if sidecars is None:
+            sidecars = set()
+            for key, value_start, value_end in members:
+                if key == _SIDECAR_KEY:
+                    sidecars = set(orjson.loads(buffer[value_start:value_end]))
+            members = [member for member in members if member[0] != _SIDECAR_KEY]
+        lazy = {}
+        for key, value_start, value_end in members:
+            # the attribute name depends on the value's type, so stand in an empty
+            # container for objects and arrays. Strings are short enough to decode
+            head = buffer[value_start : value_start + 1]
+            if head == b'"':
+                value = orjson.loads(buffer[value_start:value_end])
+            else:
+                value = {b"{": {}, b"[": []}.get(head)
+            lazy[_attr_name(key, value, sidecars)] = (key, value_start, value_end)
+        self.__dict__["_lazy"] = lazy
+        self.__dict__["_lazy_source"] = (buffer, base_dir, sidecars)
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set yet, i.e. unread lazy keys.
+        # Anything missing is an AttributeError, so hasattr and getattr defaults work
+        lazy = self.__dict__.get("_lazy")
+        missing = AttributeError(
+            f"{type(self).__name__!r} object has no attribute {name!r}"
+        )
+        if not lazy or name not in lazy:
+            raise missing
+        key, start, end = lazy.pop(name)
+        buffer, base_dir, sidecars = self.__dict__["_lazy_source"]
+        if key[-3:] == "_do" and name != key and buffer[start : start + 1] == b"{":
+            value = DataObj()
+            value._index(buffer, start, base_dir, sidecars)
+        elif key[-3:] == "_do" and name != key:
+            value = []
+            for _, item_start, _ in _json_members(buffer, start):
+                value.append(DataObj())
+                value[-1]._index(buffer, item_start, base_dir, sidecars)
+        else:
+            self.load_dic({key: orjson.loads(buffer[start:end])}, base_dir, sidecars)
+            if name not in self.__dict__:
+                raise missing
+            return self.__dict__[name]
+        self.__dict__[name] = value
+        return value
+
+    def __dir__(self):
+        return list(super().__dir__()) + list(self.__dict__.get("_lazy", ()))
+
+    def _materialize(self):
+        # read every key that is still lazy
+        for name in list(self.__dict__.get("_lazy", ())):
+            getattr(self, name)
+
+
+    def load_file(self, name):
+        with _open_file(name, "rb") as file:
+            strb = file.read()
+        self.load_dic(orjson.loads(strb), os.path.dirname(os.path.abspath(name)))
+        print(self.__dict__.keys())
+
+
+    # recursive
+    def check_list(self, item):
+        if type(item) is list:
+            return len(item) > 0 and self.check_list(item[0])
+        if (type(item) is float) or (type(item) is int):
+            return True
+        else:
+            return False
+
+    def load_dic(self, dic, base_dir=None, sidecars=None):
+        # base_dir: folder that "_npy" sidecar paths are relative to
+        # sidecars: the paths export wrote as sidecars, other "_npy" strings stay
+        # plain values. None reads them from the manifest key of a top-level dic
+
+        dic_2 = dic.copy()
+        top = sidecars is None
+        if top:
+            sidecars = set(dic_2.pop(_SIDECAR_KEY, ()))
+        for key in dic.keys():
+            if top and key == _SIDECAR_KEY:
+                continue
+
+            # arrays saved next to the json by export(array_threshold=...)
+            if (
+                (key[-4:] == "_npy")
+                and (type(dic[key]) is str)
+                and (dic[key] in sidecars)
+            ):
+                path = os.path.join(base_dir or "", dic[key])
+                del dic_2[key]
+                dic_2[key[:-4]] = np.load(path, mmap_mode="c")
+                continue
+
+            # arrays saved by export(typed_arrays=True)
+            if (key[-3:] == "_nd") and (type(dic[key]) is dict):
+                del dic_2[key]
+                dic_2[key[:-3]] = _decode_array(dic[key])
+                continue
+
+            # handle numpy arrays
+            # only the first element is checked, so ragged lists of numbers are
+            # caught when numpy refuses them, and stay lists
+            if self.check_list(dic[key]):
+                try:
+                    dic_2[key] = np.array(dic[key])
+                except ValueError:
+                    pass
+
+            # handle lists of objects of type JsonTool
+            if (type(dic[key]) is list) and (key[-3:] == "_do"):
+                ls = dic_2[key]
+                del dic_2[key]
+                for i in range(len(ls)):
+                    sub_dic = ls[i]
+                    ls[i] = DataObj()
+                    ls[i].load_dic(sub_dic, base_dir, sidecars)
+                dic_2[key[:-3]] = ls
+                continue
+
+            # handle keys with value of type JsonTool
+            if key[-3:] == "_do":
+                sub_dic = dic[key]
+                del dic_2[key]
+                dic_2[key[:-3]] = DataObj()
+                dic_2[key[:-3]].load_dic(sub_dic, base_dir, sidecars)
+        self.__dict__.update(dic_2)
+
+    def export_dic(self, sidecar=None, prefix="", typed_arrays=False):
+        # sidecar: optional _Sidecar that takes large arrays out of the json.
+        # prefix: "/"-separated key path of this object, where its sidecar files go
+        # typed_arrays: store arrays with their dtype and shape (see export)
+        self._materialize()
+        # arrays loaded from sidecars are memory maps, which orjson does not take
+        dic = {
+            k: v.view(np.ndarray) if isinstance(v, np.memmap) else v
+            for k, v in self.__dict__.items()
+            if k not in _LAZY_ATTRS
+        }
+        dic_2 = dic.copy()
+        for key in dic.keys():
+
+            if (sidecar is not None) and sidecar.takes(dic[key]):
+                del dic_2[key]
+                dic_2[str(key) + "_npy"] = sidecar.save(prefix + str(key), dic[key])
+                continue
+
+            if (
+                typed_arrays
+                and isinstance(dic[key], np.ndarray)
+                and not dic[key].dtype.hasobject
+            ):
+                del dic_2[key]
+                dic_2[str(key) + "_nd"] = _encode_array(dic[key])
+                continue
+
+            # handle non-continuous numpy arrays
+            if isinstance(dic[key], np.ndarray):
+                is_continuous = dic[key].flags.contiguous
+                # print(is_continuous)
+                if not is_continuous:
+                    dic_2[key] = dic[key].copy(order="C")
+                # orjson does not serialize 0-d arrays
+                if dic[key].ndim == 0:
+                    dic_2[key] = dic[key].item()
+
+
+            if (type(dic[key]) is type(self)) or issubclass(type(dic[key]), type(self)):
+                # dic[key] = dic[key].export_dic()
+                json_tool_dic = dic[key].export_dic(
+                    sidecar, f"{prefix}{key}/", typed_arrays
+                )
+                del dic_2[key]
+                new_key = str(key) + "_do"
+                dic_2[new_key] = json_tool_dic
+
+            if (type(dic[key]) is list) and dic[key] and (
+                (type(dic[key][0]) is type(self))
+                or issubclass(type(dic[key][0]), type(self))
+            ):
+                ls = []
+                for i, item in enumerate(dic[key]):
+                    ls.append(
+                        dic[key][i].export_dic(
+                            sidecar, f"{prefix}{key}/{i}/", typed_arrays
+                        )
+                    )
+
+                del dic_2[key]
+                new_key = str(key) + "_do"
+                dic_2[new_key] = ls
+        return dic_2
+
+
+class DataObjWriter:
+    """
+    Appends DataObj records to a JSON Lines file, one export_dic per line, so a
+    long acquisition can save each record as it is taken instead of re-exporting
+    a growing list. The file is flushed every `flush_every` records and/or every
+    `flush_interval` seconds, and with fsync=True also synced to disk. Use it as a
+    context manager, or call close(). Read the file back with iter_data_objs.
+    With `compression` (or a name ending in .gz, .xz or .zst) every session
+    appends a new compressed stream to the file, which the readers decode
+    together. lzma cannot flush a stream without ending it, so there every flush
+    ends the stream and the next record starts another. Flush it rarely, since
+    each stream is compressed on its own.
+    """
+
+    def __init__(
+        self,
+        name,
+        flush_every=1,
+        flush_interval=None,
+        fsync=False,
+        typed_arrays=False,
+        compression=None,
+    ):
+        name, name_compression = _split_compression(name)
+        compression = compression or name_compression
+        if name[-6:] != ".jsonl":
+            name = name + ".jsonl"
+        if compression is not None:
+            name = name + _EXTENSIONS[compression]
+        self.name = name
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+        self.typed_arrays = typed_arrays
+        self.compression = compression
+        self.closed = False
+        self._file = _open_file(name, "ab", compression)
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, obj):
+        if self.closed:
+            raise ValueError("write to a closed DataObjWriter")
+        if self._file is None:
+            # the last lzma stream was ended by flush
+            self._file = _open_file(self.name, "ab", self.compression)
+        self._file.write(
+            orjson.dumps(
+                obj.export_dic(typed_arrays=self.typed_arrays),
+                option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE,
+            )
+        )
+        self._pending += 1
+        due = self.flush_every is not None and self._pending >= self.flush_every
+        if self.flush_interval is not None:
+            due |= time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        if self._file is not None:
+            if self.compression == "lzma":
+                # LZMAFile.flush does nothing; only ending the stream writes it out
+                self._file.close()
+                self._file = None
+            else:
+                self._file.flush()
+        if self.fsync:
+            with open(self.name, "ab") as file:
+                os.fsync(file.fileno())
+        self._pending = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        if not self.closed:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def iter_data_objs(name):
+    """
+    Yields the records of a DataObjWriter file one DataObj at a time. A last line
+    or compressed stream cut short by a crash is skipped.
+    """
+    base_dir = os.path.dirname(os.path.abspath(name))
+    with _open_file(name, "rb") as file:
+        lines = iter(file)
+        while True:
+            try:
+                line = next(lines)
+            except (StopIteration, EOFError):
+                return
+            if not line.strip():
+                continue
+            try:
+                dic = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                if line[-1:] == b"\n":
+                    raise
+                return
+            obj = DataObj()
+            obj.load_dic(dic, base_dir)
+            yield obj
+
+
+# compressed files. The format is picked by the compression argument or the
+# extension when writing, and by magic bytes when reading, so a misnamed file
+# still loads.
+_CHUNK_SIZE = 1 << 20
+_EXTENSIONS = {"gzip": ".gz", "lzma": ".xz", "zstd": ".zst"}
+_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"\xfd7zXZ\x00": "lzma",
+    b"\x28\xb5\x2f\xfd": "zstd",
+}
+
+
+def _split_compression(name):
+    # name without a compression extension, and the compression it names
+    for compression, extension in _EXTENSIONS.items():
+        if name.endswith(extension):
+            return name[: -len(extension)], compression
+    if name.endswith(".lzma"):
+        return name[:-5], "lzma"
+    return name, None
+
+
+def _detect_compression(name):
+    with open(name, "rb") as file:
+        head = file.read(6)
+    for magic, compression in _MAGIC.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def _open_file(name, mode, compression=None):
+    # binary file object for mode "rb", "wb" or "ab", compressed as requested or,
+    # for reading, as detected
+    if mode == "rb":
+        compression = _detect_compression(name)
+    if compression is None:
+        return open(name, mode)
+    if compression == "gzip":
+        return gzip.open(name, mode)
+    if compression == "lzma":
+        return lzma.open(name, mode)
+    if compression != "zstd":
+        raise ValueError(f"Unknown compression {compression!r}")
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("zstd compression needs the zstandard package") from None
+    raw = open(name, mode)
+    if mode == "rb":
+        reader = zstandard.ZstdDecompressor().stream_reader(
+            raw, read_across_frames=True, closefd=True
+        )
+        return io.BufferedReader(reader)
+    return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+
+
+def _encode_array(array):
+    # dtype (as a numpy descr, so byte order and structured fields survive), shape
+    # and base64 of the C-ordered bytes
+    return {
+        "dtype": np.lib.format.dtype_to_descr(array.dtype),
+        "shape": list(array.shape),
+        "data": base64.b64encode(np.ascontiguousarray(array).data).decode(),
+    }
+
+
+def _decode_array(dic):
+    dtype = np.lib.format.descr_to_dtype(_descr_from_json(dic["dtype"]))
+    buffer = bytearray(base64.b64decode(dic["data"]))
+    return np.frombuffer(buffer, dtype=dtype).reshape(dic["shape"])
+
+
+def _descr_from_json(descr):
+    # json turns the (name, dtype[, shape]) tuples of a structured descr into lists
+    if type(descr) is not list:
+        return descr
+    fields = []
+    for field in descr:
+        name, dtype = field[0], _descr_from_json(field[1])
+        if len(field) == 2:
+            fields.append((name, dtype))
+        else:
+            fields.append((name, dtype, tuple(field[2])))
+    return fields
+
+
+_LAZY_ATTRS = ("_lazy", "_lazy_source")
+# top-level key listing the sidecar files of an export
+_SIDECAR_KEY = "_sidecars"
+
+_JSON_SPACE = re.compile(rb"\s*")
+_JSON_SCALAR_END = re.compile(rb"[\s,}\]]")
+
+
+def _attr_name(key, value, sidecars):
+    # the attribute load_dic sets for `value` stored under `key`
+    if (key[-4:] == "_npy") and (type(value) is str) and (value in sidecars):
+        return key[:-4]
+    if (key[-3:] == "_nd") and (type(value) is dict):
+        return key[:-3]
+    if (key[-3:] == "_do") and (type(value) in (dict, list)):
+        return key[:-3]
+    return key
+
+
+def _skip_space(buffer, position):
+    return _JSON_SPACE.match(buffer, position).end()
+
+
+def _json_members(buffer, start):
+    # (key, value_start, value_end) of every member of the json object at `start`,
+    # or (None, value_start, value_end) of every element of the array at `start`.
+    # Values are skipped over, not decoded.
+    members = []
+    is_object = buffer[start : start + 1] == b"{"
+    position = _skip_space(buffer, start + 1)
+    while buffer[position : position + 1] not in (b"}", b"]", b""):
+        key = None
+        if is_object:
+            key_end = _json_value_end(buffer, position)
+            key = orjson.loads(buffer[position:key_end])
+            position = _skip_space(buffer, _skip_space(buffer, key_end) + 1)
+        value_end = _json_value_end(buffer, position)
+        members.append((key, position, value_end))
+        position = _skip_space(buffer, value_end)
+        if buffer[position : position + 1] == b",":
+            position = _skip_space(buffer, position + 1)
+    return members
+
+
+def _json_value_end(buffer, position):
+    # end of the json value at `position`, found with buffer.find wherever possible so
+    # that long strings and flat number arrays are skipped at memchr speed
+    first = buffer[position : position + 1]
+    if first == b'"':
+        end = buffer.find(b'"', position + 1)
+        while _escaped(buffer, end):
+            end = buffer.find(b'"', end + 1)
+        return end + 1
+    if first == b"[":
+        end = buffer.find(b"]", position)
+        if all(buffer.find(c, position + 1, end) == -1 for c in (b"[", b"{", b'"')):
+            return end + 1
+    if first in (b"[", b"{"):
+        members = _json_members(buffer, position)
+        end = members[-1][2] if members else position + 1
+        return buffer.find(b"]" if first == b"[" else b"}", end) + 1
+    return _JSON_SCALAR_END.search(buffer, position).start()
+
+
+def _escaped(buffer, quote):
+    # whether the quote at `quote` is preceded by an odd number of backslashes
+    n = 0
+    while buffer[quote - n - 1 : quote - n] == b"\\":
+        n += 1
+    return n % 2 == 1
+
+
+class _Sidecar:
+    # writes arrays with at least `threshold` elements as .npy files in a folder next
+    # to the json file, one subfolder per nested object, and hands back the path to
+    # store in the json. `saved` holds every such path, for the manifest
+    def __init__(self, json_name, threshold):
+        self.folder = os.path.basename(json_name[:-5]) + "_arrays"
+        self.path = os.path.join(os.path.dirname(json_name), self.folder)
+        self.threshold = threshold
+        self.saved = set()
+
+    def takes(self, value):
+        return isinstance(value, np.ndarray) and value.size >= self.threshold
+
+    def save(self, key_path, array):
+        file_name = key_path + ".npy"
+        if self.folder + "/" + file_name in self.saved:
+            raise ValueError(f"Two arrays would be saved as {file_name}")
+        self.saved.add(self.folder + "/" + file_name)
+        path = os.path.join(self.path, *file_name.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write beside and swap in, since the array may be memory-mapped from the
+        # file it replaces, e.g. when re-exporting a loaded object under its name
+        with open(path + ".tmp", "wb") as file:
+            np.save(file, array)
+        os.replace(path + ".tmp", path)
+        return self.folder + "/" + file_name
+
+
+# would be cool if this could overload the list functionality if I only wanted to use this object as a list.
+# right now it does not encode lists of numpy arrays correctly.
+
+
+if __name__ == "__main__":
+    # create a DataObj with various things inside, including a list of DataObj, a single DataObj,
+    # and an extra numpy array.
+    parent = DataObj()
+    parent.items = []
+    # for i in range(20):
+    #     struct = DataObj()
+    #     struct.item = "this is an item"
+    #     struct.dB = f"{i} dB"
+    #     struct.ls = [
+    #         np.array([3, 34, 2, 43]),
+    #         np.array([3, 34, 2, 43]),
+    #         np.array([3, 34, 2, 43]),
+    #     ]
+    #     struct.arr = np.array([23, 2, 34, 2, 43, 3, 4.433])
+    #     parent.items.append(struct)
+    # parent.extraObj = DataObj()
+    # parent.extraObj.item = "this is an item inside an nested DataObj"
+    # parent.numpy = np.array([3, 54, 3, 45, 2, 5, 7, 3])
+    # # export
+    # parent.export("try_this.json")
+
+    # # import
+    # parent_2 = DataObj("try_this.json")
+    # print(type(parent_2))
+    # for item in parent_2.__dict__.keys():
+    #     print(item)
+    # print(parent_2.extraObj.item)
+    # print()
+    # print(parent_2.numpy)
+    # print(type(parent_2.numpy))
+    # print()
+    # print([parent_2.items[i].dB for i in range(10)])
+    # print([parent_2.items[i].arr for i in range(10)])
+    parent.items.append([np.array([4,5,23,45,3,4]),np.array([4,5,23,45,3,4]),np.array([55,5,23,45,3,4])])
+    parent.export("try_this.json")
+    print()
+    parent_2 = DataObj("try_this.json")
+    print(parent_2.items)
+    print(type(parent_2.items))
+    # print(parent.check_numpy(parent.items))
+
+
+